@@ -4,41 +4,145 @@
 
 import argparse
 import boto3
-import s3fs
 import mimetypes
 import os
+import io
+import asyncio
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from os import getenv
 from dotenv import load_dotenv
 import logging
-from botocore.exceptions import ClientError
-from hashlib import md5
+from botocore.exceptions import BotoCoreError, ClientError
+from botocore.config import Config
+from hashlib import md5, sha256
+import hmac
+from urllib.parse import quote, urlsplit
 from time import localtime
 from datetime import datetime, timedelta
 import pytz
 import requests
 import random
 import json
+import itertools
+import zlib
 
 
 
 # Load the environment variables
 load_dotenv()
 
+# Shared botocore configuration for every S3 client (Connection pool size, TCP keepalive and retries)
+CLIENT_CONFIG = Config(
+    max_pool_connections=64,
+    tcp_keepalive=True,
+    retries={'max_attempts': 8, 'mode': 'adaptive'},
+)
+
+# Defaults for the random-access object reader
+DEFAULT_BLOCK_SIZE = 8 * 1024 * 1024  # 8MB aligned ranged GETs
+DEFAULT_BLOCK_CACHE_SIZE = 256 * 1024 * 1024  # In-memory LRU cap in bytes
+DEFAULT_READ_AHEAD = 2  # Number of blocks prefetched on sequential reads
+DEFAULT_DISK_CACHE_SIZE = 2 * 1024 * 1024 * 1024  # On-disk block cache cap in bytes
+DEFAULT_DISK_CACHE_TTL = 3600  # Seconds the cached size and ETag of an object are trusted without a HEAD
+
+# Bytes read from each file for content type detection
+CONTENT_TYPE_HEADER_BYTES = 8192
+
+# Control-plane reads made for every bucket by --audit-buckets: setting -> (operation, error codes meaning "not configured")
+BUCKET_AUDIT_CHECKS = {
+    'Region': ('get_bucket_location', ()),
+    'Versioning': ('get_bucket_versioning', ()),
+    'Encryption': ('get_bucket_encryption', ('ServerSideEncryptionConfigurationNotFoundError',)),
+    'Lifecycle': ('get_bucket_lifecycle_configuration', ('NoSuchLifecycleConfiguration',)),
+    'Policy': ('get_bucket_policy', ('NoSuchBucketPolicy',)),
+    'Website': ('get_bucket_website', ('NoSuchWebsiteConfiguration',)),
+}
+
+# Object search: streamed chunk size, longest line kept in memory and characters printed per match
+SEARCH_CHUNK_SIZE = 64 * 1024
+SEARCH_MAX_LINE_BYTES = 1024 * 1024
+SEARCH_PREVIEW_CHARS = 500
+
+# State cache kept inside mirrored directories
+MIRROR_STATE_FILE = '.s3-mirror-state.json'
+
+
+def get_cache_dir(*parts):
+    # Local cache directory (Override with the cache_dir environment variable)
+    base = getenv("cache_dir") or os.path.join(os.path.expanduser("~"), ".cache", "aws-python-s3")
+    path = os.path.join(base, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def folder_for_mime_type(mime_type):
+    # Folder name for a MIME type: its usual extension, otherwise the subtype (e.g. inode/x-empty -> x-empty)
+    extension = mimetypes.guess_extension(mime_type) if mime_type else None
+    if extension:
+        return extension[1:]
+    if mime_type and '/' in mime_type:
+        return mime_type.split('/', 1)[1].replace('/', '-')
+    return 'unknown'
+
+
+def format_size(num_bytes):
+    # Human readable size using binary units
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if abs(num_bytes) < 1024 or unit == 'TB':
+            return f"{num_bytes:.2f} {unit}" if unit != 'B' else f"{int(num_bytes)} B"
+        num_bytes /= 1024
+
+
+def prune_block_cache(cache_dir, max_bytes):
+    # Remove the least recently used blocks of the on-disk block cache until it fits in max_bytes
+    blocks = []
+    for root, dirs, files in os.walk(cache_dir):
+        for file in files:
+            if file.endswith('.blk'):
+                path = os.path.join(root, file)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                blocks.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in blocks)
+    for _, size, path in sorted(blocks):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def write_json_atomic(path, data):
+    # Write JSON through a temporary file and rename it so readers never see a partial file
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as json_file:
+        json.dump(data, json_file, default=str)
+    os.replace(temp_path, path)
+
+
 class S3Client:
     # Initialize the S3 client
     def __init__(self):
+        self.session = boto3.Session(
+            aws_access_key_id=getenv("aws_access_key_id"),
+            aws_secret_access_key=getenv("aws_secret_access_key"),
+            aws_session_token=getenv("aws_session_token"),
+            region_name=getenv("region"))
         self.client = self.init_client()
         self.resource = self.init_resource()
+        self.pool = S3ClientPool(self.session, self.client, BucketRegionCache(os.path.join(get_cache_dir(), 'bucket-regions.json')))
 
     def init_client(self):
         # Initialize the S3 client
         try:
-            client = boto3.client(
-                "s3",
-                aws_access_key_id=getenv("aws_access_key_id"),
-                aws_secret_access_key=getenv("aws_secret_access_key"),
-                aws_session_token=getenv("aws_session_token"),
-                region_name=getenv("region"))
+            client = self.session.client("s3", endpoint_url=getenv("endpoint_url") or None, config=CLIENT_CONFIG)
             client.list_buckets()
             return client
         except ClientError as e:
@@ -51,12 +155,7 @@ class S3Client:
     def init_resource(self):
         # Initialize the S3 resource
         try:
-            resource = boto3.resource(
-                "s3",
-                aws_access_key_id=getenv("aws_access_key_id"),
-                aws_secret_access_key=getenv("aws_secret_access_key"),
-                aws_session_token=getenv("aws_session_token"),
-                region_name=getenv("region"))
+            resource = self.session.resource("s3", endpoint_url=getenv("endpoint_url") or None, config=CLIENT_CONFIG)
             return resource
         except ClientError as e:
             logging.error(e)
@@ -65,6 +164,19 @@ class S3Client:
             logging.error("Unexpected Error")
             raise e
 
+    def bucket_region(self, bucket_name):
+        # Region of a bucket, looked up once and then served from the persistent cache
+        return self.pool.region_for(bucket_name)
+
+    def client_for(self, bucket_name):
+        # Client for the bucket's region so requests reach the right endpoint without a redirect
+        try:
+            return self.pool.client_for(bucket_name)
+        except ClientError as e:
+            # Unknown or inaccessible buckets fall back to the default client, which reports the real error
+            logging.debug(e)
+            return self.client
+
     def list_buckets(self):
         # List all of the available buckets
         try:
@@ -83,7 +195,8 @@ class S3Client:
     def delete_bucket(self, bucket_name):
     # Delete the S3 bucket
         try:
-            self.client.delete_bucket(Bucket=bucket_name)
+            self.client_for(bucket_name).delete_bucket(Bucket=bucket_name)
+            self.pool.forget(bucket_name)
         except ClientError as e:
             if e.response['Error']['Code'] == 'BucketNotEmpty':
                 print(f'Bucket {bucket_name} could not be deleted because it is not empty.')
@@ -99,6 +212,7 @@ class S3Client:
             location = {'LocationConstraint': region}
             if self.client.create_bucket(Bucket=bucket_name,
                                     CreateBucketConfiguration=location):
+                self.pool.region_cache.set(bucket_name, region)
                 print(f'Successfully created bucket {bucket_name}.')
         except ClientError as e:
             logging.error(e)
@@ -132,7 +246,7 @@ class S3Client:
 
     def bucket_exists(self, bucket_name):
         try:
-            response = self.client.head_bucket(Bucket=bucket_name)
+            response = self.client_for(bucket_name).head_bucket(Bucket=bucket_name)
             statuscode = response['ResponseMetadata']['HTTPStatusCode']
             print(f'S3 Bucket: {bucket_name} || Status: Exists || HTTP Status Code: {statuscode}')
         except ClientError as e:
@@ -147,7 +261,7 @@ class S3Client:
 
     def upload_file(self, bucket_name, filename):
         try:
-            self.client.upload_file(filename, bucket_name, filename)
+            self.client_for(bucket_name).upload_file(filename, bucket_name, filename)
             print(f"File uploaded successfully to {bucket_name}")
             return True
         except ClientError as e:
@@ -157,7 +271,7 @@ class S3Client:
     def upload_file_object(self, bucket_name, filename):
         try:
             with open(filename, "rb") as file:
-                self.client.upload_fileobj(file, bucket_name, filename)
+                self.client_for(bucket_name).upload_fileobj(file, bucket_name, filename)
                 print(f"File object uploaded successfully to {bucket_name}")
             return True
         except ClientError as e:
@@ -167,7 +281,7 @@ class S3Client:
     def upload_file_put(self, bucket_name, filename):
         try:
             with open(filename, "rb") as file:
-                self.client.put_object(Bucket=bucket_name, Key=filename, Body=file.read())
+                self.client_for(bucket_name).put_object(Bucket=bucket_name, Key=filename, Body=file.read())
                 print(f"File uploaded successfully to {bucket_name}")
             return True
         except ClientError as e:
@@ -175,7 +289,7 @@ class S3Client:
             return False
 
     def multipart_upload(self, bucket_name, key, filename):
-        mpu = self.client.create_multipart_upload(Bucket=bucket_name, Key=key)
+        mpu = self.client_for(bucket_name).create_multipart_upload(Bucket=bucket_name, Key=key)
         mpu_id = mpu["UploadId"]
         parts = []
         uploaded_bytes = 0
@@ -187,12 +301,12 @@ class S3Client:
                 data = file.read(1024 * 1024)  # 1MB chunks
                 if not len(data):
                     break
-                part = self.client.upload_part(Body=data, Bucket=bucket_name, Key=key, UploadId=mpu_id, PartNumber=i)
+                part = self.client_for(bucket_name).upload_part(Body=data, Bucket=bucket_name, Key=key, UploadId=mpu_id, PartNumber=i)
                 parts.append({"PartNumber": i, "ETag": part["ETag"]})
                 uploaded_bytes += len(data)
                 print("{0} of {1} uploaded".format(uploaded_bytes, total_bytes))
                 i += 1
-        result = self.client.complete_multipart_upload(
+        result = self.client_for(bucket_name).complete_multipart_upload(
             Bucket=bucket_name, Key=key, UploadId=mpu_id, MultipartUpload={"Parts": parts}
         )
         print(f"File uploaded successfully! Location: {result['Location']}, Bucket: {result['Bucket']}, Key: {result['Key']}, ETag: {result['ETag']}")
@@ -264,7 +378,7 @@ class S3Client:
             return None
 
         try:
-            self.client.upload_fileobj(io.BytesIO(content), Bucket=bucket_name, Key=file_name)
+            self.client_for(bucket_name).upload_fileobj(io.BytesIO(content), Bucket=bucket_name, Key=file_name)
         except Exception as e:
             logging.error(f"Error uploading file to S3: {e}")
 
@@ -273,10 +387,7 @@ class S3Client:
                 my_file.write(content)
 
         # Construct the website URL
-        location = self.client.get_bucket_location(Bucket=bucket_name)
-        region = location['LocationConstraint']
-        if region == None:
-            region = 'us-east-1'
+        region = self.bucket_region(bucket_name)
 
         s3_url = "https://{0}.s3.{1}.amazonaws.com/{2}".format(bucket_name, region, file_name)
         print(f"The file is available at {s3_url}")
@@ -287,10 +398,9 @@ class S3Client:
         import magic
         try:
             mime_type = magic.from_file(filename, mime=True)
-            extension = mimetypes.guess_extension(mime_type)
-            folder = extension[1:]
+            folder = folder_for_mime_type(mime_type)
             key = f"{folder}/{filename}"
-            self.client.upload_file(filename, bucket_name, key)
+            self.client_for(bucket_name).upload_file(filename, bucket_name, key)
 
             print(f"File uploaded successfully to {bucket_name}/{folder}")
             return True
@@ -300,7 +410,7 @@ class S3Client:
 
     def set_object_access_policy(self, bucket_name, file_name):
         try:
-            response = self.client.put_object_acl(
+            response = self.client_for(bucket_name).put_object_acl(
                 ACL='public-read',
                 Bucket=bucket_name,
                 Key=file_name
@@ -334,8 +444,8 @@ class S3Client:
 
     def create_bucket_policy(self, bucket_name):
         try:
-            self.client.delete_public_access_block(Bucket=bucket_name)
-            self.client.put_bucket_policy(
+            self.client_for(bucket_name).delete_public_access_block(Bucket=bucket_name)
+            self.client_for(bucket_name).put_bucket_policy(
                 Bucket=bucket_name,
                 Policy=self.generate_public_read_policy(bucket_name)
             )
@@ -347,7 +457,7 @@ class S3Client:
 
     def read_bucket_policy(self, bucket_name):
         try:
-            policy = self.client.get_bucket_policy(Bucket=bucket_name)
+            policy = self.client_for(bucket_name).get_bucket_policy(Bucket=bucket_name)
             policy_str = policy['Policy']
             print(policy_str)
         except ClientError as e:
@@ -369,7 +479,7 @@ class S3Client:
             ]
         }
         try:
-            self.client.put_bucket_lifecycle_configuration(
+            self.client_for(bucketname).put_bucket_lifecycle_configuration(
                 Bucket=bucketname,
                 LifecycleConfiguration=LifecycleConfiguration
             )
@@ -381,7 +491,7 @@ class S3Client:
 
     def get_lifecycle_config(self, bucketname):
         try:
-            response = self.client.get_bucket_lifecycle_configuration(Bucket=bucketname)
+            response = self.client_for(bucketname).get_bucket_lifecycle_configuration(Bucket=bucketname)
             print(response)
             return response
         except ClientError as e:
@@ -394,7 +504,7 @@ class S3Client:
     def manage_s3_object(self, bucket_name, file_name, flag):
         if flag == ':delete':
             try:
-                self.client.delete_object(Bucket=bucket_name, Key=file_name)
+                self.client_for(bucket_name).delete_object(Bucket=bucket_name, Key=file_name)
                 print(f"Successfully deleted {file_name} from {bucket_name}")
                 return True
             except ClientError as e:
@@ -402,7 +512,7 @@ class S3Client:
                 return False
         elif flag == ':download':
             try:
-                self.client.download_file(bucket_name, file_name, file_name)
+                self.client_for(bucket_name).download_file(bucket_name, file_name, file_name)
                 print(f"Successfully downloaded {file_name} from {bucket_name}")
                 return True
             except ClientError as e:
@@ -410,7 +520,7 @@ class S3Client:
                 return False
         elif flag == ':versions':
             try:
-                versions = self.client.list_object_versions(Bucket=bucket_name, Prefix=file_name)
+                versions = self.client_for(bucket_name).list_object_versions(Bucket=bucket_name, Prefix=file_name)
                 print(f'Current versions of {file_name}: \n')
                 for version in versions['Versions']:
                     print(f"Version ID: {version['VersionId']}")
@@ -425,10 +535,10 @@ class S3Client:
                 return False
         elif flag == ':lastversion':
             try:
-                versions = self.client.list_object_versions(Bucket=bucket_name, Prefix=file_name)
+                versions = self.client_for(bucket_name).list_object_versions(Bucket=bucket_name, Prefix=file_name)
                 if len(versions['Versions']) > 1:
                     last_version = versions['Versions'][1]
-                    self.client.copy_object(Bucket=bucket_name, CopySource={'Bucket': bucket_name, 'Key': file_name, 'VersionId': last_version['VersionId']}, Key=file_name)
+                    self.client_for(bucket_name).copy_object(Bucket=bucket_name, CopySource={'Bucket': bucket_name, 'Key': file_name, 'VersionId': last_version['VersionId']}, Key=file_name)
                     print(f"Successfully uploaded the second last version of {file_name} as the newest in {bucket_name}")
                     return True
                 else:
@@ -440,8 +550,8 @@ class S3Client:
         elif flag == ':rename':
             try:
                 new_name = input("Enter a new name for the object: ")
-                self.client.copy_object(Bucket=bucket_name, CopySource={'Bucket': bucket_name, 'Key': file_name}, Key=new_name)
-                self.client.delete_object(Bucket=bucket_name, Key=file_name)
+                self.client_for(bucket_name).copy_object(Bucket=bucket_name, CopySource={'Bucket': bucket_name, 'Key': file_name}, Key=new_name)
+                self.client_for(bucket_name).delete_object(Bucket=bucket_name, Key=file_name)
                 print(f"Successfully renamed {file_name} to {new_name} in {bucket_name}")
                 return True
             except ClientError as e:
@@ -453,7 +563,7 @@ class S3Client:
                 if new_name == file_name:
                     print("Error: The new name must be different from the original name.")
                     return False
-                self.client.copy_object(Bucket=bucket_name, CopySource={'Bucket': bucket_name, 'Key': file_name}, Key=new_name)
+                self.client_for(bucket_name).copy_object(Bucket=bucket_name, CopySource={'Bucket': bucket_name, 'Key': file_name}, Key=new_name)
                 print(f"Successfully copied {file_name} to {new_name} in {bucket_name}")
                 return True
             except ClientError as e:
@@ -461,11 +571,11 @@ class S3Client:
                 return False
         elif flag == ':setversion':
             try:
-                response = self.client.list_object_versions(Bucket=bucket_name, Prefix=file_name)
+                response = self.client_for(bucket_name).list_object_versions(Bucket=bucket_name, Prefix=file_name)
                 current_versions = response['Versions']
                 version_id = str(input('Enter your desired version ID (leave blank for latest):'))
                 if len(version_id) > 0:
-                    self.resource.Object(bucket_name, file_name).copy_from(CopySource={'Bucket': bucket_name, 'Key': file_name, 'VersionId': version_id})
+                    self.client_for(bucket_name).copy_object(Bucket=bucket_name, Key=file_name, CopySource={'Bucket': bucket_name, 'Key': file_name, 'VersionId': version_id})
                     print(f'The Object {file_name} was successfully updated with version ID {version_id}')
                 else:
                     print(f'No version ID was provided, the object {file_name} remains unchanged')
@@ -478,7 +588,7 @@ class S3Client:
 
     def check_versioning(self, bucket_name):
         try:
-            response = self.client.get_bucket_versioning(Bucket=bucket_name)
+            response = self.client_for(bucket_name).get_bucket_versioning(Bucket=bucket_name)
             status = response['Status']
             print(f'Versioning status for {bucket_name}: {status}')
             return status
@@ -506,76 +616,139 @@ class S3Client:
 
     def rollback_to_first(self, bucket_name, object_key):
         try:
-            response = self.client.list_object_versions(Bucket=bucket_name, Prefix=object_key)
+            response = self.client_for(bucket_name).list_object_versions(Bucket=bucket_name, Prefix=object_key)
             first_version = response['Versions'][0]
-            self.resource.Object(bucket_name, object_key).copy_from(CopySource={'Bucket': bucket_name, 'Key': object_key, 'VersionId': first_version.id})
+            self.client_for(bucket_name).copy_object(Bucket=bucket_name, Key=object_key, CopySource={'Bucket': bucket_name, 'Key': object_key, 'VersionId': first_version['VersionId']})
             return True
         except ClientError as e:
             print(f"Error: {e}")
             return False
 
 
-    def organize_by_extension(self, bucket_name):
+    def open_inventory(self, bucket_name, inventory):
+        # Load an S3 Inventory manifest (s3://bucket/key or a local path) for the given source bucket
+        # The data files live in the bucket holding the manifest
+        client = self.client_for(inventory[len('s3://'):].split('/', 1)[0]) if inventory.startswith('s3://') else self.client
+        try:
+            reader = S3InventoryReader(client, inventory)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # Missing or malformed manifests and unsupported formats
+            detail = f"missing field {e}" if isinstance(e, KeyError) else e
+            print(f"Could not read the inventory {inventory}: {detail}")
+            return None
+        if reader.source_bucket and reader.source_bucket != bucket_name:
+            print(f"The inventory {inventory} was generated for {reader.source_bucket}, not {bucket_name}")
+            return None
+        return reader
+
+    def iter_records(self, bucket_name, prefix='', inventory=None):
+        # Current objects from an inventory report when one is given, otherwise from the listing
+        if inventory:
+            reader = self.open_inventory(bucket_name, inventory)
+            if reader is None:
+                raise ValueError(f"Inventory {inventory} cannot be used for bucket {bucket_name}")
+            return reader.iter_records(prefix)
+        return self.iter_objects(bucket_name, prefix)
+
+    def plan_organize_by_extension(self, records):
+        # Moves that put every object into a folder named after its extension
+        plan = []
+        for obj in records:
+            # Use the file extension (the part after the last dot) as the folder name
+            folder = obj['Key'].rsplit('.', 1)[-1]
+
+            # Check if the object is already in the correct folder
+            if not obj['Key'].startswith(folder + '/'):
+                plan.append((obj['Key'], f"{folder}/{obj['Key']}"))
+        return plan
+
+    def plan_organize_by_type(self, bucket_name, records):
+        # Moves that put every object into a folder named after its main content type
+        plan = []
+        for obj in records:
+            obj_metadata = self.client_for(bucket_name).head_object(Bucket=bucket_name, Key=obj['Key'])
+            content_type = obj_metadata['ContentType']
+
+            # Use the main type (the part before the slash) as the folder name
+            folder = content_type.split('/')[0]
+
+            # Check if the object is already in the correct folder
+            if not obj['Key'].startswith(folder + '/'):
+                plan.append((obj['Key'], f"{folder}/{obj['Key']}"))
+        return plan
+
+    def move_objects(self, bucket_name, plan):
+        # Apply a list of (key, new_key) moves
+        for key, new_key in plan:
+            self.client_for(bucket_name).copy_object(Bucket=bucket_name, CopySource={'Bucket': bucket_name, 'Key': key}, Key=new_key)
+            self.client_for(bucket_name).delete_object(Bucket=bucket_name, Key=key)
+
+    def organize_by_extension(self, bucket_name, inventory=None):
         try:
-            s3objects = self.client.list_objects(Bucket=bucket_name).get('Contents')
+            # Plan every move before touching the bucket so moved objects are never listed twice.
+            # Records are streamed into the planner, only the moves are kept in memory
+            records = iter(self.iter_records(bucket_name, inventory=inventory))
+            first = next(records, None)
 
-            if not s3objects:
+            if first is None:
                 print("No objects found in the bucket or the bucket does not exist.")
                 return False
 
             # Move each object to the corresponding folder
-            for obj in s3objects:
-                # Use the file extension (the part after the last dot) as the folder name
-                folder = obj['Key'].rsplit('.', 1)[-1]
-
-                new_key = f"{folder}/{obj['Key']}"
-
-                # Check if the object is already in the correct folder
-                if not obj['Key'].startswith(folder + '/'):
-                    self.client.copy_object(Bucket=bucket_name, CopySource={'Bucket': bucket_name, 'Key': obj['Key']}, Key=new_key)
-                    self.client.delete_object(Bucket=bucket_name, Key=obj['Key'])
+            self.move_objects(bucket_name, self.plan_organize_by_extension(itertools.chain([first], records)))
 
             print("Successfully organized files into folders based on their file extension")
             return True
 
-        except ClientError as e:
+        except (ClientError, ValueError) as e:
             print(f"An error occurred: {e}")
             return False
 
-    def organize_by_type(self, bucket_name):
+    def organize_by_type(self, bucket_name, inventory=None):
         try:
-            s3objects = self.client.list_objects(Bucket=bucket_name)['Contents']
+            records = self.iter_records(bucket_name, inventory=inventory)
 
             # Move each object to the corresponding folder
-            for obj in s3objects:
-                obj_metadata = self.client.head_object(Bucket=bucket_name, Key=obj['Key'])
-                content_type = obj_metadata['ContentType']
-
-                # Use the main type (the part before the slash) as the folder name
-                folder = content_type.split('/')[0]
-
-                new_key = f"{folder}/{obj['Key']}"
-
-                # Check if the object is already in the correct folder
-                if not obj['Key'].startswith(folder + '/'):
-                    self.client.copy_object(Bucket=bucket_name, CopySource={'Bucket': bucket_name, 'Key': obj['Key']}, Key=new_key)
-                    self.client.delete_object(Bucket=bucket_name, Key=obj['Key'])
+            self.move_objects(bucket_name, self.plan_organize_by_type(bucket_name, records))
 
             print("Successfully organized files into folders based on their content type")
             return True
-        except ClientError as e:
+        except (ClientError, ValueError) as e:
             print(f"An error occurred: {e}")
             return False
 
-    def clean_old_versions(self, bucket_name, file_name, day=180):
+    def plan_clean_old_versions(self, versions, file_name, day=180):
+        # Versions of file_name (Prefix match) last modified more than day days ago
+        age = datetime.now(pytz.utc) - timedelta(days=day)
+        return [{'Key': version['Key'], 'VersionId': version['VersionId']}
+                for version in versions
+                if version['Key'].startswith(file_name) and version.get('VersionId')
+                and not version.get('IsDeleteMarker') and version['LastModified'] < age]
+
+    def iter_versions(self, bucket_name, prefix=''):
+        # Stream every object version under a prefix
+        paginator = self.client_for(bucket_name).get_paginator('list_object_versions')
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            for version in page.get('Versions', []):
+                yield version
+
+    def clean_old_versions(self, bucket_name, file_name, day=180, inventory=None):
         try:
-            age = datetime.now(pytz.utc) - timedelta(days=day)
-            all_objects = self.client.list_object_versions(Bucket=bucket_name, Prefix=file_name)
-            versions_to_delete = [{'Key': version['Key'], 'VersionId': version['VersionId']}
-                        for version in all_objects.get('Versions', [])
-                        if version['LastModified'] < age]
+            if inventory:
+                reader = self.open_inventory(bucket_name, inventory)
+                if reader is None:
+                    return False
+                if not reader.has_versions:
+                    print(f"The inventory {inventory} does not include object versions")
+                    return False
+                versions = reader.iter_records(file_name, current_only=False)
+            else:
+                versions = self.iter_versions(bucket_name, file_name)
+            versions_to_delete = self.plan_clean_old_versions(versions, file_name, day)
+            # DeleteObjects accepts at most 1000 keys per request
+            for i in range(0, len(versions_to_delete), 1000):
+                self.client_for(bucket_name).delete_objects(Bucket=bucket_name, Delete={'Objects': versions_to_delete[i:i + 1000]})
             if versions_to_delete:
-                self.client.delete_objects(Bucket=bucket_name, Delete={'Objects': versions_to_delete})
                 print(f'Deleted versions of the {file_name} older than {day} days.')
             return True
         except ClientError as e:
@@ -589,7 +762,7 @@ class S3Client:
         }
         if flag == 'get':
             try:
-                response = self.client.get_bucket_website(Bucket=bucket_name)
+                response = self.client_for(bucket_name).get_bucket_website(Bucket=bucket_name)
                 print(f'Website configuration for {bucket_name}: {response}')
                 return response
             except ClientError as e:
@@ -597,9 +770,9 @@ class S3Client:
                 return False
         elif flag == 'upload':
             try:
-                self.client.upload_file('index.html', bucket_name, 'index.html', ExtraArgs={'ContentType': 'text/html'})
+                self.client_for(bucket_name).upload_file('index.html', bucket_name, 'index.html', ExtraArgs={'ContentType': 'text/html'})
                 print(f"Successfully uploaded index.html to {bucket_name}")
-                self.client.upload_file('error.html', bucket_name, 'error.html', ExtraArgs={'ContentType': 'text/html'})
+                self.client_for(bucket_name).upload_file('error.html', bucket_name, 'error.html', ExtraArgs={'ContentType': 'text/html'})
                 print(f"Successfully uploaded error.html to {bucket_name}")
                 return True
             except ClientError as e:
@@ -607,7 +780,7 @@ class S3Client:
                 return False
         elif flag == 'set':
             try:
-                self.client.put_bucket_website(Bucket=bucket_name, WebsiteConfiguration=website_configuration)
+                self.client_for(bucket_name).put_bucket_website(Bucket=bucket_name, WebsiteConfiguration=website_configuration)
                 print(f"Successfully set the website configuration for {bucket_name}")
                 return True
             except ClientError as e:
@@ -615,7 +788,7 @@ class S3Client:
                 return False
         elif flag == 'delete':
             try:
-                self.client.delete_bucket_website(Bucket=bucket_name)
+                self.client_for(bucket_name).delete_bucket_website(Bucket=bucket_name)
                 print(f"Successfully deleted the website configuration for {bucket_name}")
                 return True
             except ClientError as e:
@@ -623,7 +796,7 @@ class S3Client:
                 return False
 
     def print_object_metadata(self, bucket_name, object_key):
-        obj_metadata = self.client.head_object(Bucket=bucket_name, Key=object_key)
+        obj_metadata = self.client_for(bucket_name).head_object(Bucket=bucket_name, Key=object_key)
         print(obj_metadata)
 
     def generate_quote(self, flag='show'):
@@ -672,13 +845,13 @@ class S3Client:
                     content_type = mimetypes.guess_type(file)[0] or 'binary/octet-stream'
 
                     print(f"Uploading {local_file_path} to {bucket_name}/{s3_file_path}")
-                    self.client.upload_file(local_file_path, bucket_name, s3_file_path, ExtraArgs={'ContentType': content_type})
+                    self.client_for(bucket_name).upload_file(local_file_path, bucket_name, s3_file_path, ExtraArgs={'ContentType': content_type})
 
             # Website Configuration
             website_configuration = {
             'IndexDocument': {'Suffix': 'index.html'}
             }
-            self.client.put_bucket_website(Bucket=bucket_name, WebsiteConfiguration=website_configuration)
+            self.client_for(bucket_name).put_bucket_website(Bucket=bucket_name, WebsiteConfiguration=website_configuration)
             print(f"Successfully set the website configuration for {bucket_name}")
 
             # Set Permissions
@@ -692,16 +865,11 @@ class S3Client:
                 "Resource": f"arn:aws:s3:::{bucket_name}/*"
             }]
             }
-            self.client.put_bucket_policy(Bucket=bucket_name, Policy=json.dumps(policy))
+            self.client_for(bucket_name).put_bucket_policy(Bucket=bucket_name, Policy=json.dumps(policy))
             print(f'Successfully set the bucket policy for {bucket_name}')
 
             # Construct the website URL
-            location = self.client.get_bucket_location(Bucket=bucket_name)
-            region = location['LocationConstraint']
-
-            # If the region is None, the bucket is in us-east-1 (Normal System behavior)
-            if region is None:
-                region = 'us-east-1'
+            region = self.bucket_region(bucket_name)
             website_url = f'https://{bucket_name}.s3-website-{region}.amazonaws.com'
 
             print(f'Your website is hosted at : {website_url}')
@@ -709,12 +877,28 @@ class S3Client:
             logging.error(e)
             return False
 
-    def get_file_stats(self, bucket_name):
+    def get_file_stats(self, bucket_name, inventory=None):
         file_stats = {}
         try:
-            response = self.client.list_objects_v2(Bucket=bucket_name)
-            if 'Contents' in response:
-                for item in response['Contents']:
+            if inventory:
+                # Group the inventory columns by extension instead of building a dict per object
+                import pyarrow as pa
+                import pyarrow.compute as pc
+                reader = self.open_inventory(bucket_name, inventory)
+                if reader is None:
+                    return False
+                for chunk in reader.iter_chunks():
+                    # Same extension as os.path.splitext, leading dots of the file name are not separators
+                    extensions = pc.extract_regex(chunk['Key'], r'(?s)^(?:.*/)?\.*[^/.][^/]*\.(?P<ext>[^./]*)$')
+                    totals = pa.table({'Ext': pc.fill_null(pc.struct_field(extensions, [0]), ''), 'Size': chunk['Size']})
+                    totals = totals.group_by('Ext').aggregate([('Size', 'sum'), ('Size', 'count')])
+                    for file_extension, size_bytes, count in zip(totals['Ext'].to_pylist(), totals['Size_sum'].to_pylist(),
+                                                                 totals['Size_count'].to_pylist()):
+                        stats = file_stats.setdefault(file_extension, {'Count': 0, 'Size': 0})
+                        stats['Count'] += count
+                        stats['Size'] += size_bytes
+            else:
+                for item in self.iter_objects(bucket_name):
                     file_key = item['Key']
                     file_extension = os.path.splitext(file_key)[1][1:]
                     size_bytes = item['Size']
@@ -724,7 +908,7 @@ class S3Client:
                         file_stats[file_extension]['Size'] += size_bytes
                     else:
                         file_stats[file_extension] = {'Count': 1, 'Size': size_bytes}
-        except ClientError as e:
+        except (ClientError, ValueError) as e:
             logging.error(e)
             return False
         for stat in file_stats:
@@ -734,14 +918,21 @@ class S3Client:
             print(f"  - Number of files: {file_stats[stat]['Count']}")
             print(f"  - Total size in bytes: {file_stats[stat]['Size']}")
             print(f"  - Total size in KB: {size_kb}")
-            print(f"  - Total size in MB: {'{:.16f}'.format(size_mb)}")
+            print(f"  - Total size in MB: {'{:.2f}'.format(size_mb)}")
 
-    def get_all_stats(self, bucket_name):
+    def get_all_stats(self, bucket_name, inventory=None):
         file_stats = {'Count': 0, 'Size': 0}
         try:
-            response = self.client.list_objects_v2(Bucket=bucket_name)
-            if 'Contents' in response:
-                for item in response['Contents']:
+            if inventory:
+                import pyarrow.compute as pc
+                reader = self.open_inventory(bucket_name, inventory)
+                if reader is None:
+                    return False
+                for chunk in reader.iter_chunks():
+                    file_stats['Count'] += chunk.num_rows
+                    file_stats['Size'] += pc.sum(chunk['Size']).as_py() or 0
+            else:
+                for item in self.iter_objects(bucket_name):
                     file_stats['Count'] += 1
                     file_stats['Size'] += item['Size']
             size_kb = file_stats['Size'] / 1024
@@ -749,14 +940,14 @@ class S3Client:
             print(f'Number of files: {file_stats["Count"]}')
             print(f'Total size in bytes: {file_stats["Size"]}')
             print(f'Total size in KB: {size_kb}')
-            print(f"Total size in MB: {'{:.16f}'.format(size_mb)}")
-        except ClientError as e:
+            print(f"Total size in MB: {'{:.2f}'.format(size_mb)}")
+        except (ClientError, ValueError) as e:
             logging.error(e)
             return False
 
     def set_bucket_encryption(self, bucket_name):
         try:
-            result = self.client.put_bucket_encryption(
+            result = self.client_for(bucket_name).put_bucket_encryption(
                 Bucket=bucket_name,
                 ServerSideEncryptionConfiguration={
                     "Rules": [
@@ -772,6 +963,598 @@ class S3Client:
             logging.error(e)
             return False
 
+    def open_object(self, bucket_name, object_key, block_size=DEFAULT_BLOCK_SIZE, cache_size=DEFAULT_BLOCK_CACHE_SIZE,
+                    read_ahead=DEFAULT_READ_AHEAD, disk_cache=False):
+        # Open a seekable file-like reader over an S3 object
+        cache_dir = get_cache_dir("blocks") if disk_cache else None
+        return S3ObjectReader(self.client_for(bucket_name), bucket_name, object_key, block_size=block_size, cache_size=cache_size,
+                              read_ahead=read_ahead, cache_dir=cache_dir)
+
+    def read_range(self, bucket_name, object_key, offset, length, disk_cache=False):
+        # Write a byte range of an object to stdout (A negative offset counts from the end of the object)
+        try:
+            with self.open_object(bucket_name, object_key, disk_cache=disk_cache) as reader:
+                if offset < 0:
+                    reader.seek(max(reader.size + offset, 0))
+                else:
+                    reader.seek(offset)
+                remaining = length if length >= 0 else reader.size
+                while remaining > 0:
+                    data = reader.read(min(remaining, reader.block_size))
+                    if not data:
+                        break
+                    sys.stdout.buffer.write(data)
+                    remaining -= len(data)
+                sys.stdout.buffer.flush()
+            return True
+        except ClientError as e:
+            logging.error(e)
+            print(f"Error reading {object_key} from {bucket_name}. Error: {e}")
+            return False
+
+    def tail_object(self, bucket_name, object_key, lines=10, disk_cache=False):
+        # Print the last lines of an object, reading backwards one block at a time
+        try:
+            with self.open_object(bucket_name, object_key, read_ahead=0, disk_cache=disk_cache) as reader:
+                data = b''
+                position = reader.size
+                while position > 0 and data.count(b'\n') <= lines:
+                    start = max(position - reader.block_size, 0)
+                    reader.seek(start)
+                    data = reader.read(position - start) + data
+                    position = start
+                tail = data.splitlines(keepends=True)[-lines:] if lines > 0 else []
+                sys.stdout.buffer.write(b''.join(tail))
+                sys.stdout.buffer.flush()
+            return True
+        except ClientError as e:
+            logging.error(e)
+            print(f"Error reading {object_key} from {bucket_name}. Error: {e}")
+            return False
+
+    def iter_objects(self, bucket_name, prefix=''):
+        # Stream the objects under a prefix one listing page at a time
+        paginator = self.client_for(bucket_name).get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            for item in page.get('Contents', []):
+                yield item
+
+    def mirror_prefix(self, bucket_name, prefix, local_dir, delete=False, max_workers=8):
+        # Download every object under a prefix into a local directory, skipping files whose
+        # size and ETag match the state cache. Transfers run concurrently with a bounded number in flight
+        local_dir = os.path.abspath(local_dir)
+        os.makedirs(local_dir, exist_ok=True)
+        state_path = os.path.join(local_dir, MIRROR_STATE_FILE)
+        try:
+            with open(state_path) as state_file:
+                state = json.load(state_file)
+        except (FileNotFoundError, ValueError):
+            state = {}
+        if state.get('Bucket') != bucket_name or state.get('Prefix') != prefix:
+            state = {'Bucket': bucket_name, 'Prefix': prefix, 'Objects': {}}
+        objects = state['Objects']
+
+        seen = set()
+        seen_paths = set()
+        counts = {'Downloaded': 0, 'Skipped': 0, 'Failed': 0, 'Deleted': 0}
+        in_flight = set()
+        lock = threading.Lock()
+
+        def download(key, local_path, entry):
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            temp_path = f"{local_path}.{threading.get_ident()}.s3tmp"
+            try:
+                self.client_for(bucket_name).download_file(bucket_name, key, temp_path)
+                os.replace(temp_path, local_path)
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            with lock:
+                objects[key] = entry
+
+        def collect(done):
+            for future in done:
+                in_flight.discard(future)
+                try:
+                    future.result()
+                    counts['Downloaded'] += 1
+                except Exception as e:
+                    logging.error(e)
+                    counts['Failed'] += 1
+
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for item in self.iter_objects(bucket_name, prefix):
+                    key = item['Key']
+                    if key.endswith('/'):
+                        continue
+                    local_path = self._mirror_local_path(local_dir, prefix, key)
+                    if local_path is None:
+                        print(f"Skipping {key}: it resolves outside of {local_dir}")
+                        continue
+                    seen.add(key)
+                    seen_paths.add(local_path)
+                    entry = {'Size': item['Size'], 'ETag': item['ETag']}
+                    cached = objects.get(key)
+                    if cached == entry and os.path.isfile(local_path) and os.path.getsize(local_path) == item['Size']:
+                        counts['Skipped'] += 1
+                        continue
+                    # Keep memory bounded by never queueing more than a few transfers per worker
+                    if len(in_flight) >= max_workers * 2:
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        collect(done)
+                    in_flight.add(executor.submit(download, key, local_path, entry))
+                collect(wait(in_flight)[0])
+
+            if delete:
+                for key in [key for key in objects if key not in seen]:
+                    del objects[key]
+                for root, dirs, files in os.walk(local_dir):
+                    for file in files:
+                        local_path = os.path.join(root, file)
+                        if local_path != state_path and local_path not in seen_paths:
+                            os.remove(local_path)
+                            counts['Deleted'] += 1
+        except ClientError as e:
+            logging.error(e)
+            print(f"Error mirroring {bucket_name}/{prefix}. Error: {e}")
+            return False
+        finally:
+            write_json_atomic(state_path, state)
+
+        print(f"Mirrored {bucket_name}/{prefix} to {local_dir}: {counts['Downloaded']} downloaded, {counts['Skipped']} up to date, {counts['Deleted']} deleted, {counts['Failed']} failed")
+        return counts['Failed'] == 0
+
+    def _mirror_local_path(self, local_dir, prefix, key):
+        # Map a key to a path below local_dir (None when the key would escape it)
+        relative_key = key[len(prefix):].lstrip('/')
+        local_path = os.path.abspath(os.path.join(local_dir, *relative_key.split('/')))
+        if not local_path.startswith(local_dir + os.sep):
+            return None
+        return local_path
+
+    def analyze_bucket(self, bucket_name, prefix='', output_format='json', output=None, top=10, prefix_depth=1,
+                       chunk_size=100000, inventory=None):
+        # Size histogram and percentiles, age buckets, storage class and prefix rollups for a bucket.
+        # The listing is loaded into columnar chunks so the analysis keeps up with the listing speed
+        analytics = BucketAnalytics(prefix_depth=prefix_depth)
+        try:
+            if inventory:
+                # Inventory data files are already columnar, feed them in as they are decoded
+                reader = self.open_inventory(bucket_name, inventory)
+                if reader is None:
+                    return False
+                for chunk in reader.iter_chunks(prefix):
+                    analytics.add_table(chunk)
+            else:
+                keys, sizes, last_modified, storage_classes = [], [], [], []
+                for item in self.iter_objects(bucket_name, prefix):
+                    keys.append(item['Key'])
+                    sizes.append(item['Size'])
+                    last_modified.append(item['LastModified'].timestamp())
+                    storage_classes.append(item.get('StorageClass', 'STANDARD'))
+                    if len(keys) >= chunk_size:
+                        analytics.add_chunk(keys, sizes, last_modified, storage_classes)
+                        keys, sizes, last_modified, storage_classes = [], [], [], []
+                analytics.add_chunk(keys, sizes, last_modified, storage_classes)
+        except ClientError as e:
+            logging.error(e)
+            return False
+
+        report = {'Bucket': bucket_name, 'Prefix': prefix, 'GeneratedAt': datetime.now(pytz.utc).isoformat()}
+        report.update(analytics.report(top=top))
+        self.write_report(report, output_format, output)
+        return report
+
+    def write_report(self, report, output_format='json', output=None):
+        # Write an analytics report as JSON or CSV to a file or stdout
+        output_file = open(output, 'w', newline='') if output else sys.stdout
+        try:
+            if output_format == 'csv':
+                BucketAnalytics.write_csv(report, output_file)
+            else:
+                json.dump(report, output_file, indent=2, default=str)
+                output_file.write('\n')
+        finally:
+            if output:
+                output_file.close()
+                print(f"Report written to {output}")
+
+    def upload_directory_to_folders(self, bucket_name, directory, max_workers=8):
+        # Upload every file of a directory into folders named after the detected content type.
+        # Types are detected from the first bytes of each file in a worker pool and cached by
+        # (path, size, mtime), so unchanged files are never inspected twice
+        import magic
+        local = threading.local()
+        cache = ContentTypeCache(os.path.join(get_cache_dir(), 'content-types.sqlite'))
+        directory = os.path.abspath(directory)
+        detected = []
+        counts = {'Uploaded': 0, 'Failed': 0, 'Cached': 0}
+        in_flight = set()
+
+        def detect_and_upload(local_path, key, mime_type):
+            stat = None
+            if mime_type is None:
+                # libmagic handles are not thread-safe, each worker keeps its own
+                if not hasattr(local, 'magic'):
+                    local.magic = magic.Magic(mime=True)
+                stat = os.stat(local_path)
+                with open(local_path, 'rb') as file:
+                    mime_type = local.magic.from_buffer(file.read(CONTENT_TYPE_HEADER_BYTES))
+            folder = folder_for_mime_type(mime_type)
+            self.client_for(bucket_name).upload_file(local_path, bucket_name, f"{folder}/{key}", ExtraArgs={'ContentType': mime_type})
+            return local_path, stat, mime_type
+
+        def collect(done):
+            for future in done:
+                in_flight.discard(future)
+                try:
+                    local_path, stat, mime_type = future.result()
+                    counts['Uploaded'] += 1
+                    if stat is not None:
+                        detected.append((local_path, stat.st_size, stat.st_mtime_ns, mime_type))
+                except Exception as e:
+                    logging.error(e)
+                    counts['Failed'] += 1
+            if len(detected) >= 1000:
+                cache.store(detected)
+                detected.clear()
+
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for root, dirs, files in os.walk(directory):
+                    for file in files:
+                        local_path = os.path.join(root, file)
+                        key = os.path.relpath(local_path, directory).replace(os.sep, '/')
+                        try:
+                            stat = os.stat(local_path)
+                            mime_type = cache.lookup(local_path, stat.st_size, stat.st_mtime_ns)
+                        except OSError as e:
+                            # Broken symlinks and files removed during the walk fail on their own
+                            logging.error(e)
+                            counts['Failed'] += 1
+                            continue
+                        if mime_type is not None:
+                            counts['Cached'] += 1
+                        if len(in_flight) >= max_workers * 4:
+                            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                            collect(done)
+                        in_flight.add(executor.submit(detect_and_upload, local_path, key, mime_type))
+                collect(wait(in_flight)[0])
+        finally:
+            cache.store(detected)
+            cache.close()
+
+        print(f"Uploaded {counts['Uploaded']} files from {directory} to {bucket_name} ({counts['Cached']} content types from cache, {counts['Failed']} failed)")
+        return counts['Failed'] == 0
+
+    def audit_bucket_setting(self, bucket_name, setting):
+        # Read one setting of a bucket (None when it is not configured)
+        operation, missing_codes = BUCKET_AUDIT_CHECKS[setting]
+        try:
+            if setting == 'Region':
+                return self.bucket_region(bucket_name)
+            response = getattr(self.client_for(bucket_name), operation)(Bucket=bucket_name)
+        except ClientError as e:
+            code = e.response['Error']['Code']
+            if code in missing_codes:
+                return None
+            return {'Error': code}
+        except BotoCoreError as e:
+            # Connection and endpoint errors are recorded so one bucket cannot abort the sweep
+            return {'Error': type(e).__name__}
+        response.pop('ResponseMetadata', None)
+        if setting == 'Policy':
+            return json.loads(response['Policy'])
+        if setting == 'Versioning':
+            return response.get('Status', 'Disabled')
+        # Round trip through JSON so the value compares equal to the one loaded from the snapshot
+        return json.loads(json.dumps(response, default=str))
+
+    def audit_buckets(self, snapshot_path=None, max_workers=8):
+        # Read the region, versioning, encryption, lifecycle, policy and website settings of every bucket
+        # concurrently, save them as a snapshot and print what changed since the previous snapshot
+        snapshot_path = snapshot_path or os.path.join(get_cache_dir(), 'bucket-audit.json')
+        buckets = self.list_buckets()
+        if not buckets:
+            return False
+        names = [bucket['Name'] for bucket in buckets['Buckets']]
+
+        results = {name: {} for name in names}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Resolve every region first so the setting reads go straight to the regional endpoints
+            for name, region in zip(names, executor.map(lambda name: self.audit_bucket_setting(name, 'Region'), names)):
+                results[name]['Region'] = region
+            futures = {executor.submit(self.audit_bucket_setting, name, setting): (name, setting)
+                       for name in names for setting in BUCKET_AUDIT_CHECKS if setting != 'Region'}
+            for future, (name, setting) in futures.items():
+                results[name][setting] = future.result()
+
+        try:
+            with open(snapshot_path) as snapshot_file:
+                previous = json.load(snapshot_file)
+        except (FileNotFoundError, ValueError):
+            previous = None
+
+        snapshot = {'GeneratedAt': datetime.now(pytz.utc).isoformat(), 'Buckets': results}
+        write_json_atomic(snapshot_path, snapshot)
+        print(f"Audited {len(names)} buckets, snapshot saved to {snapshot_path}")
+
+        if previous is None:
+            for name in names:
+                summary = []
+                for setting, value in results[name].items():
+                    if isinstance(value, dict) and 'Error' in value:
+                        value = f"Error ({value['Error']})"
+                    elif value is None:
+                        value = 'None'
+                    elif not isinstance(value, str):
+                        value = 'Configured'
+                    summary.append(f"{setting}={value}")
+                print(f"{name}: {', '.join(summary)}")
+            return snapshot
+
+        changes = self.diff_audit_snapshots(previous, snapshot)
+        print(f"Changes since {previous.get('GeneratedAt')}:")
+        for change in changes:
+            print(change)
+        if not changes:
+            print("No changes")
+        return snapshot
+
+    def diff_audit_snapshots(self, previous, current):
+        # Human readable differences between two audit snapshots
+        changes = []
+        old_buckets, new_buckets = previous.get('Buckets', {}), current.get('Buckets', {})
+        for name in sorted(set(old_buckets) | set(new_buckets)):
+            if name not in old_buckets:
+                changes.append(f"+ {name}: new bucket")
+            elif name not in new_buckets:
+                changes.append(f"- {name}: bucket removed")
+            else:
+                for setting in BUCKET_AUDIT_CHECKS:
+                    old_value, new_value = old_buckets[name].get(setting), new_buckets[name].get(setting)
+                    if old_value != new_value:
+                        changes.append(f"~ {name} {setting}: {json.dumps(old_value, default=str)} -> {json.dumps(new_value, default=str)}")
+        return changes
+
+    def benchmark_async(self, bucket_name, prefix='', max_keys=1000, max_workers=64):
+        # Compare fetching the same objects with the thread pool path and with AsyncS3Client
+        import time
+        keys = []
+        for item in self.iter_objects(bucket_name, prefix):
+            keys.append(item['Key'])
+            if len(keys) >= max_keys:
+                break
+        if not keys:
+            print(f"No objects found under {bucket_name}/{prefix}")
+            return False
+
+        def fetch(key):
+            return len(self.client_for(bucket_name).get_object(Bucket=bucket_name, Key=key)['Body'].read())
+
+        async def fetch_all():
+            # The client and its regional connection are set up before the timer starts and every
+            # body is dropped as soon as it is read, like the thread pool path does
+            async with AsyncS3Client(max_concurrency=max_workers, session=self.session) as s3:
+                await s3.client_for(bucket_name)
+
+                async def fetch_async(key):
+                    return len(await s3.get_object(bucket_name, key))
+
+                start = time.perf_counter()
+                total_bytes = sum(await asyncio.gather(*[fetch_async(key) for key in keys]))
+                return total_bytes, time.perf_counter() - start
+
+        results = {}
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            total_bytes = sum(executor.map(fetch, keys))
+        results['Threads'] = time.perf_counter() - start
+
+        total_bytes_async, results['Asyncio'] = asyncio.run(fetch_all())
+
+        for name, elapsed in results.items():
+            size = total_bytes if name == 'Threads' else total_bytes_async
+            print(f"{name}: {len(keys)} objects, {format_size(size)} in {elapsed:.2f}s "
+                  f"({len(keys) / elapsed:.1f} objects/s, {format_size(size / elapsed)}/s)")
+        return results
+
+    def search_objects(self, bucket_name, prefix, pattern, json_path=None, max_hits=None, max_workers=8):
+        # Find the lines matching a regex (Or the JSON lines whose json_path value matches it) in every
+        # object under a prefix. Objects are streamed and gunzipped on the fly, so memory does not depend
+        # on object size, and the search stops as soon as max_hits matches were found
+        import re
+        if json_path:
+            value_pattern = re.compile(pattern)
+            path = [int(part) if part.isdigit() else part for part in json_path.split('.')]
+            matcher = lambda line: self._match_json_line(line, path, value_pattern)
+        else:
+            line_pattern = re.compile(pattern.encode('utf-8'))
+            matcher = lambda line: line_pattern.search(line) is not None
+
+        client = self.client_for(bucket_name)
+        stop = threading.Event()
+        lock = threading.Lock()
+        hits = []
+        failed = []
+        in_flight = {}
+
+        def record_hit(key, line_number, offset, line):
+            with lock:
+                if stop.is_set():
+                    return
+                text = line.rstrip(b'\r\n').decode('utf-8', errors='replace')
+                if len(text) > SEARCH_PREVIEW_CHARS:
+                    text = text[:SEARCH_PREVIEW_CHARS] + '...'
+                hits.append({'Key': key, 'Line': line_number, 'Offset': offset, 'Text': text})
+                print(f"{key}:{line_number}:{offset}: {text}")
+                if max_hits and len(hits) >= max_hits:
+                    stop.set()
+
+        def collect(done):
+            for future in done:
+                key = in_flight.pop(future)
+                try:
+                    future.result()
+                except (ClientError, BotoCoreError, zlib.error, EOFError, OSError) as e:
+                    # One unreadable or corrupt object must not end the search of the others
+                    logging.error(f"{key}: {e}")
+                    failed.append(key)
+
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for item in self.iter_objects(bucket_name, prefix):
+                    if stop.is_set():
+                        break
+                    if item['Key'].endswith('/'):
+                        continue
+                    if len(in_flight) >= max_workers * 2:
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        collect(done)
+                    in_flight[executor.submit(self._search_object, client, bucket_name, item['Key'], matcher, record_hit, stop)] = item['Key']
+                collect(wait(in_flight)[0])
+        except ClientError as e:
+            logging.error(e)
+            print(f"Error searching {bucket_name}/{prefix}. Error: {e}")
+            return False
+
+        print(f"Found {len(hits)} matches in {bucket_name}/{prefix}" + (f" ({len(failed)} objects could not be read)" if failed else ''))
+        return hits
+
+    def _search_object(self, client, bucket_name, key, matcher, record_hit, stop):
+        # Scan one object line by line, tracking line numbers and byte offsets in the (decompressed) content
+        response = client.get_object(Bucket=bucket_name, Key=key)
+        body = response['Body']
+        try:
+            chunks = body.iter_chunks(SEARCH_CHUNK_SIZE)
+            first = next(chunks, b'')
+            # Only the magic bytes decide, a .gz suffix or Content-Encoding header can be wrong
+            gzipped = first[:2] == b'\x1f\x8b'
+            stream = self._iter_gunzip(first, chunks) if gzipped else itertools.chain([first], chunks)
+
+            carry = b''
+            offset = 0
+            line_number = 1
+            for chunk in stream:
+                if stop.is_set():
+                    return
+                carry += chunk
+                lines = carry.split(b'\n')
+                carry = lines.pop()
+                for line in lines:
+                    if matcher(line):
+                        record_hit(key, line_number, offset, line)
+                    offset += len(line) + 1
+                    line_number += 1
+                # Very long lines are scanned in fragments so memory stays bounded
+                if len(carry) > SEARCH_MAX_LINE_BYTES:
+                    if matcher(carry):
+                        record_hit(key, line_number, offset, carry)
+                    offset += len(carry)
+                    carry = b''
+            if carry and matcher(carry):
+                record_hit(key, line_number, offset, carry)
+        finally:
+            body.close()
+
+    def _iter_gunzip(self, first, chunks):
+        # Decompress a gzip stream chunk by chunk, including files made of several gzip members
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        in_member = False
+        for chunk in itertools.chain([first], chunks):
+            while chunk:
+                in_member = True
+                data = decompressor.decompress(chunk)
+                if data:
+                    yield data
+                if decompressor.eof:
+                    chunk = decompressor.unused_data
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                    in_member = False
+                else:
+                    chunk = b''
+        data = decompressor.flush()
+        if data:
+            yield data
+        if in_member:
+            raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+
+    def _match_json_line(self, line, path, value_pattern):
+        # True when the line is a JSON document whose value at path matches value_pattern
+        try:
+            value = json.loads(line)
+            for part in path:
+                value = value[part]
+        except (ValueError, KeyError, IndexError, TypeError):
+            return False
+        if not isinstance(value, str):
+            value = json.dumps(value)
+        return value_pattern.search(value) is not None
+
+    def generate_urls(self, bucket_name, mode='get', prefix='', manifest=None, expires=3600, output_format='csv',
+                      output=None, batch_size=10000):
+        # Presigned GET/PUT or public URLs for every key under a prefix or listed in a manifest (One key per line).
+        # Everything is computed locally: the region comes from the cache and the SigV4 signing key is
+        # derived once per day, so there is no network call per key
+        if mode not in ('get', 'put', 'public'):
+            print("Invalid mode. Please use 'get', 'put' or 'public'.")
+            return False
+        if not 1 <= expires <= 604800:
+            print("Presigned URLs can expire after at most 604800 seconds (7 days).")
+            return False
+
+        try:
+            region = self.bucket_region(bucket_name)
+        except ClientError as e:
+            logging.error(e)
+            return False
+        presigner = SigV4Presigner(self.session.get_credentials().get_frozen_credentials(), getenv("endpoint_url") or None)
+        scheme, host, path_prefix = presigner.base_url(bucket_name, region)
+
+        if manifest:
+            manifest_file = open(manifest)
+            keys = (line.rstrip('\r\n') for line in manifest_file if line.strip())
+        else:
+            manifest_file = None
+            keys = (item['Key'] for item in self.iter_objects(bucket_name, prefix))
+
+        output_file = open(output, 'w', newline='') if output else sys.stdout
+        count = 0
+        try:
+            if output_format == 'csv':
+                import csv
+                writer = csv.writer(output_file)
+                writer.writerow(['Key', 'Url'])
+                write = writer.writerow
+            else:
+                write = lambda row: output_file.write(json.dumps({'Key': row[0], 'Url': row[1]}) + '\n')
+
+            while True:
+                batch = list(itertools.islice(keys, batch_size))
+                if not batch:
+                    break
+                if mode == 'public':
+                    urls = ((key, f"{scheme}://{host}{path_prefix}{quote(key, safe='/~')}") for key in batch)
+                else:
+                    urls = presigner.presign(bucket_name, region, batch, method=mode.upper(), expires=expires)
+                for row in urls:
+                    write(row)
+                count += len(batch)
+        except ClientError as e:
+            logging.error(e)
+            return False
+        finally:
+            if manifest_file:
+                manifest_file.close()
+            if output:
+                output_file.close()
+
+        if output:
+            print(f"Generated {count} {mode} URLs for {bucket_name} in {output}")
+        return count
+
     # CLI functions with argparse
     def main(self):
         parser = argparse.ArgumentParser(description="S3 Client")
@@ -799,6 +1582,7 @@ class S3Client:
         parser.add_argument('--organize-by-extension', type=str, help='The name of the S3 bucket to organize.')
         parser.add_argument("--print-object-metadata", nargs=2, help="Print metadata of an object in a bucket (Arguments: bucket_name, object_key)")
         parser.add_argument("--upload-file-to-folder", nargs=2, help="Upload a file to a folder in S3 Bucket (Arguments: bucketname, filename")
+        parser.add_argument("--upload-directory-to-folders", nargs=2, help="Upload every file of a directory to folders named after their content type (Arguments: bucketname, directory)", metavar=("bucketname", "directory"))
         parser.add_argument("--clean-old-versions", nargs=3, help="Clean old versions of a file in a bucket (Arguments: bucket_name, filename, day (Default value is 180 days))")
         parser.add_argument("--rollback-to-first", nargs=2, help="Rollback an object in a bucket to its first version (Arguments: bucket_name, object_key)")
         parser.add_argument("--configure-website", nargs=2, help="Configure website for a bucket (Arguments: bucket_name, flag (get, set, upload or delete))", metavar=("bucket_name", "flag"))
@@ -807,7 +1591,28 @@ class S3Client:
         parser.add_argument("--create-website", nargs=2, help="Create a website in an S3 bucket (Arguments: bucket_name, sourcedirectory)")
         parser.add_argument("--get-file-stats", type=str, help="Get file statistics (Extension) for a bucket (Arguments: bucket_name)")
         parser.add_argument("--get-all-stats", type=str, help="Get all file statistics (Total Size) for a bucket (Arguments: bucket_name)")
+        parser.add_argument("--audit-buckets", nargs='?', const='', help="Audit the region, versioning, encryption, lifecycle, policy and website settings of every bucket and show changes since the last audit (Arguments: snapshot_path (Optional))")
         parser.add_argument("--encrypt-bucket", type=str, help="Enable bucket encryption (Arguments: bucket_name)")
+        parser.add_argument("--read-range", nargs=4, help="Print a byte range of an object (Arguments: bucket_name, object_key, offset (negative counts from the end), length (-1 reads to the end))", metavar=("bucket_name", "object_key", "offset", "length"))
+        parser.add_argument("--tail-object", nargs='+', help="Print the last lines of an object (Arguments: bucket_name, object_key, lines (Default value is 10))")
+        parser.add_argument("--mirror-prefix", nargs=3, help="Download a prefix into a local directory, skipping files that are already up to date (Arguments: bucket_name, prefix, local_dir)", metavar=("bucket_name", "prefix", "local_dir"))
+        parser.add_argument("--delete", action="store_true", help="Delete local files that no longer exist in the bucket (Used with --mirror-prefix)")
+        parser.add_argument("--analyze-bucket", type=str, help="Size histogram, percentiles, age, storage class and prefix breakdowns for a bucket (Arguments: bucket_name)")
+        parser.add_argument("--prefix", type=str, default='', help="Only include keys under this prefix (Used with --analyze-bucket and --generate-urls)")
+        parser.add_argument("--format", choices=['json', 'jsonl', 'csv'], default='json', help="Output format: json or csv for --analyze-bucket, jsonl (json) or csv for --generate-urls (Default value is json)")
+        parser.add_argument("--output", type=str, help="Write the report to this file instead of stdout")
+        parser.add_argument("--top", type=int, default=10, help="Number of largest prefixes to report (Default value is 10)")
+        parser.add_argument("--prefix-depth", type=int, default=1, help="Folder depth used for the prefix rollups (Default value is 1)")
+        parser.add_argument("--benchmark-async", nargs='+', help="Time fetching up to 1000 objects with the thread pool and with the asyncio client (Arguments: bucket_name, prefix (Optional))")
+        parser.add_argument("--search-objects", nargs=3, help="Print the lines matching a regular expression in every object under a prefix, gzip files included (Arguments: bucket_name, prefix, pattern)", metavar=("bucket_name", "prefix", "pattern"))
+        parser.add_argument("--json-path", type=str, help="Match the pattern against this field of JSON lines instead of the whole line, e.g. request.status (Used with --search-objects)")
+        parser.add_argument("--max-hits", type=int, help="Stop after this many matches (Used with --search-objects)")
+        parser.add_argument("--generate-urls", nargs=2, help="Generate URLs for every key under --prefix or listed in --key-manifest without a request per key (Arguments: bucket_name, mode (get, put or public))", metavar=("bucket_name", "mode"))
+        parser.add_argument("--key-manifest", type=str, help="File with one object key per line (Used with --generate-urls)")
+        parser.add_argument("--expires", type=int, default=3600, help="Presigned URL lifetime in seconds (Default value is 3600)")
+        parser.add_argument("--inventory", type=str, help="Read objects from an S3 Inventory manifest (s3://bucket/path/manifest.json or a local path) instead of listing the bucket (Used with --get-file-stats, --get-all-stats, --analyze-bucket, --organize-by-type, --organize-by-extension and --clean-old-versions)")
+        parser.add_argument("--workers", type=int, default=8, help="Number of concurrent transfers (Default value is 8)")
+        parser.add_argument("--disk-cache", action="store_true", help="Keep fetched blocks in the local disk cache so repeat reads skip the network (Used with --read-range and --tail-object)")
 
 
         args = parser.parse_args()
@@ -831,9 +1636,9 @@ class S3Client:
         elif args.check_versioning:
             self.check_versioning(args.check_versioning)
         elif args.organize_by_extension:
-            self.organize_by_extension(args.organize_by_extension)
+            self.organize_by_extension(args.organize_by_extension, args.inventory)
         elif args.organize_by_type:
-            self.organize_by_type(args.organize_by_type)
+            self.organize_by_type(args.organize_by_type, args.inventory)
         elif args.list_bucket_names:
             self.list_bucket_names()
         elif args.delete_bucket:
@@ -860,8 +1665,10 @@ class S3Client:
             self.manage_s3_object(args.manage_s3_object[0], args.manage_s3_object[1], args.manage_s3_object[2])
         elif args.upload_file_to_folder:
             self.upload_file_to_folder(args.upload_file_to_folder[0], args.upload_file_to_folder[1])
+        elif args.upload_directory_to_folders:
+            self.upload_directory_to_folders(args.upload_directory_to_folders[0], args.upload_directory_to_folders[1], args.workers)
         elif args.clean_old_versions:
-            self.clean_old_versions(args.clean_old_versions[0], args.clean_old_versions[1], int(args.clean_old_versions[2]))
+            self.clean_old_versions(args.clean_old_versions[0], args.clean_old_versions[1], int(args.clean_old_versions[2]), args.inventory)
         elif args.rollback_to_first:
             self.rollback_to_first(args.rollback_to_first[0], args.rollback_to_first[1])
         elif args.configure_website:
@@ -873,11 +1680,1020 @@ class S3Client:
         elif args.create_website:
             self.create_website(args.create_website[0], args.create_website[1])
         elif args.get_file_stats:
-            self.get_file_stats(args.get_file_stats)
+            self.get_file_stats(args.get_file_stats, args.inventory)
         elif args.get_all_stats:
-            self.get_all_stats(args.get_all_stats)
+            self.get_all_stats(args.get_all_stats, args.inventory)
         elif args.encrypt_bucket:
             self.set_bucket_encryption(args.encrypt_bucket)
+        elif args.audit_buckets is not None:
+            self.audit_buckets(args.audit_buckets or None, args.workers)
+        elif args.read_range:
+            self.read_range(args.read_range[0], args.read_range[1], int(args.read_range[2]), int(args.read_range[3]), args.disk_cache)
+        elif args.tail_object:
+            if len(args.tail_object) not in (2, 3):
+                parser.error("--tail-object expects bucket_name, object_key and an optional number of lines")
+            lines = int(args.tail_object[2]) if len(args.tail_object) > 2 else 10
+            self.tail_object(args.tail_object[0], args.tail_object[1], lines, args.disk_cache)
+        elif args.analyze_bucket:
+            self.analyze_bucket(args.analyze_bucket, args.prefix, args.format, args.output, args.top, args.prefix_depth, inventory=args.inventory)
+        elif args.benchmark_async:
+            prefix = args.benchmark_async[1] if len(args.benchmark_async) > 1 else ''
+            self.benchmark_async(args.benchmark_async[0], prefix, max_workers=args.workers)
+        elif args.search_objects:
+            self.search_objects(args.search_objects[0], args.search_objects[1], args.search_objects[2], args.json_path, args.max_hits, args.workers)
+        elif args.generate_urls:
+            self.generate_urls(args.generate_urls[0], args.generate_urls[1], args.prefix, args.key_manifest, args.expires, args.format, args.output)
+        elif args.mirror_prefix:
+            self.mirror_prefix(args.mirror_prefix[0], args.mirror_prefix[1], args.mirror_prefix[2], args.delete, args.workers)
+
+class S3ObjectReader(io.RawIOBase):
+    # Seekable, read-only file-like view of an S3 object.
+    # Data is fetched in aligned blocks with ranged GETs, sequential reads prefetch the next
+    # blocks in the background and recently used blocks are kept in an LRU cache capped by size.
+    # When cache_dir is set, blocks are also stored on disk (keyed by ETag) together with the object's size and
+    # ETag, so repeat reads within disk_cache_ttl seconds skip the network. The disk tier is capped at
+    # disk_cache_size bytes and the least recently used blocks are removed when the reader is closed.
+    # Callers that already know the object's size and ETag can pass them to skip the HEAD request.
+    def __init__(self, client, bucket_name, key, block_size=DEFAULT_BLOCK_SIZE, cache_size=DEFAULT_BLOCK_CACHE_SIZE,
+                 read_ahead=DEFAULT_READ_AHEAD, cache_dir=None, max_workers=4, size=None, etag=None,
+                 disk_cache_size=DEFAULT_DISK_CACHE_SIZE, disk_cache_ttl=DEFAULT_DISK_CACHE_TTL):
+        super().__init__()
+        self.client = client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.block_size = block_size
+        self.cache_size = max(cache_size, block_size)
+        self.read_ahead = read_ahead
+
+        self.cache_root = None
+        self._position = 0
+        self._blocks = OrderedDict()
+        self._cached_bytes = 0
+        self._pending = {}
+        self._last_block = None
+        # Re-entrant because read-ahead callbacks may run in the thread that scheduled them
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+
+        self.cache_root = cache_dir
+        self.disk_cache_size = disk_cache_size
+        self._metadata_path = None
+        # Set when the size and ETag come from the metadata file, a 412 then means they are stale
+        self._metadata_cached = False
+        if cache_dir and (size is None or etag is None):
+            self._metadata_path = os.path.join(cache_dir, md5(f"{bucket_name}/{key}".encode('utf-8')).hexdigest() + '.json')
+            size, etag = self._load_metadata(self._metadata_path, disk_cache_ttl)
+            self._metadata_cached = etag is not None
+        if size is None or etag is None:
+            size, etag = self._head()
+        self._set_metadata(size, etag)
+
+    def _head(self):
+        metadata = self.client.head_object(Bucket=self.bucket_name, Key=self.key)
+        size, etag = metadata['ContentLength'], metadata['ETag']
+        if self._metadata_path:
+            write_json_atomic(self._metadata_path, {'Size': size, 'ETag': etag, 'CachedAt': datetime.now(pytz.utc).timestamp()})
+        return size, etag
+
+    def _set_metadata(self, size, etag):
+        # Blocks on disk are keyed by ETag, so a new version of the object gets its own directory
+        self.size = size
+        self.etag = etag.strip('"')
+        self.cache_dir = None
+        if self.cache_root:
+            object_id = md5(f"{self.bucket_name}/{self.key}/{self.etag}".encode('utf-8')).hexdigest()
+            self.cache_dir = os.path.join(self.cache_root, object_id)
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _refresh_metadata(self, stale_etag):
+        # The object was overwritten after its metadata was cached: forget it, HEAD again and
+        # drop the blocks of the old version (Only the first of the concurrent failed reads does this)
+        with self._lock:
+            if self.etag != stale_etag:
+                return
+            self._metadata_cached = False
+            try:
+                os.remove(self._metadata_path)
+            except FileNotFoundError:
+                pass
+            self._set_metadata(*self._head())
+            self._blocks.clear()
+            self._cached_bytes = 0
+
+    def _load_metadata(self, metadata_path, ttl):
+        # Size and ETag from a previous open, if they are recent enough to be trusted
+        try:
+            with open(metadata_path) as metadata_file:
+                metadata = json.load(metadata_file)
+        except (FileNotFoundError, ValueError):
+            return None, None
+        if datetime.now(pytz.utc).timestamp() - metadata.get('CachedAt', 0) > ttl:
+            return None, None
+        return metadata.get('Size'), metadata.get('ETag')
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence value: {whence}")
+        if position < 0:
+            raise ValueError("Negative seek position")
+        self._position = position
+        return self._position
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        written = 0
+        while written < len(view) and self._position < self.size:
+            index, offset = divmod(self._position, self.block_size)
+            block = self._get_block(index)
+            chunk = block[offset:offset + len(view) - written]
+            view[written:written + len(chunk)] = chunk
+            written += len(chunk)
+            self._position += len(chunk)
+        return written
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = max(self.size - self._position, 0)
+        buffer = bytearray(min(size, max(self.size - self._position, 0)))
+        read = self.readinto(buffer)
+        return bytes(buffer[:read])
+
+    def readall(self):
+        return self.read()
+
+    def close(self):
+        if not self.closed:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            with self._lock:
+                self._blocks.clear()
+                self._pending.clear()
+                self._cached_bytes = 0
+            if self.cache_root:
+                prune_block_cache(self.cache_root, self.disk_cache_size)
+        super().close()
+
+    def _block_path(self, index):
+        return os.path.join(self.cache_dir, f"{index}.blk")
+
+    def _fetch_block(self, index, retry=True):
+        # Serve the block from the disk tier when possible, otherwise issue a ranged GET
+        if self.cache_dir:
+            try:
+                with open(self._block_path(index), 'rb') as block_file:
+                    data = block_file.read()
+                # The modification time doubles as the last access time for the LRU cleanup
+                os.utime(self._block_path(index))
+                return data
+            except FileNotFoundError:
+                pass
+
+        start = index * self.block_size
+        if start >= self.size:
+            # The object shrank when it was overwritten
+            return b''
+        end = min(start + self.block_size, self.size) - 1
+        etag, metadata_cached = self.etag, self._metadata_cached
+        try:
+            response = self.client.get_object(Bucket=self.bucket_name, Key=self.key, Range=f"bytes={start}-{end}", IfMatch=etag)
+        except ClientError as e:
+            if not (retry and metadata_cached and e.response['Error']['Code'] in ('PreconditionFailed', '412')):
+                raise
+            self._refresh_metadata(etag)
+            return self._fetch_block(index, retry=False)
+        data = response['Body'].read()
+
+        if self.cache_dir:
+            temp_path = f"{self._block_path(index)}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as block_file:
+                block_file.write(data)
+            os.replace(temp_path, self._block_path(index))
+        return data
+
+    def _get_block(self, index):
+        with self._lock:
+            block = self._blocks.get(index)
+            if block is not None:
+                self._blocks.move_to_end(index)
+            else:
+                future = self._pending.get(index)
+                if future is None:
+                    future = self._executor.submit(self._fetch_block, index)
+                    self._pending[index] = future
+            # Prefetch the following blocks when the access pattern is sequential
+            if self._last_block is None or index in (self._last_block, self._last_block + 1):
+                self._schedule_read_ahead(index)
+            self._last_block = index
+        if block is not None:
+            return block
+
+        block = future.result()
+        with self._lock:
+            self._pending.pop(index, None)
+            self._store_block(index, block)
+        return block
+
+    def _schedule_read_ahead(self, index):
+        # Caller must hold the lock
+        last_index = (self.size - 1) // self.block_size
+        for next_index in range(index + 1, min(index + self.read_ahead, last_index) + 1):
+            if next_index not in self._blocks and next_index not in self._pending:
+                future = self._executor.submit(self._fetch_block, next_index)
+                future.add_done_callback(lambda f, i=next_index: self._read_ahead_done(i, f))
+                self._pending[next_index] = future
+
+    def _read_ahead_done(self, index, future):
+        if future.cancelled() or future.exception() is not None:
+            with self._lock:
+                self._pending.pop(index, None)
+            return
+        with self._lock:
+            if self._pending.pop(index, None) is not None:
+                self._store_block(index, future.result())
+
+    def _store_block(self, index, block):
+        # Caller must hold the lock. Evict least recently used blocks beyond the memory cap
+        if index in self._blocks:
+            return
+        self._blocks[index] = block
+        self._cached_bytes += len(block)
+        while self._cached_bytes > self.cache_size and len(self._blocks) > 1:
+            _, evicted = self._blocks.popitem(last=False)
+            self._cached_bytes -= len(evicted)
+
+
+class BucketAnalytics:
+    # Columnar accumulator for listing records. Records are added in chunks and every
+    # aggregate is computed with NumPy over the whole chunk instead of per-item dict updates
+    SIZE_BINS_PER_POWER = 8  # Fine log2 bins used for the histogram and the percentile estimates
+    SIZE_POWERS = 64
+    AGE_EDGES_DAYS = [1, 7, 30, 90, 180, 365, 730]
+    AGE_LABELS = ['< 1 day', '1-7 days', '7-30 days', '30-90 days', '90-180 days', '180-365 days', '1-2 years', '> 2 years']
+    PERCENTILES = [50, 90, 95, 99, 99.9]
+
+    def __init__(self, prefix_depth=1, now=None):
+        import numpy as np
+        self.np = np
+        self.prefix_depth = prefix_depth
+        self.now = now if now is not None else datetime.now(pytz.utc).timestamp()
+        self.count = 0
+        self.total_bytes = 0
+        self.min_size = None
+        self.max_size = None
+        bins = self.SIZE_BINS_PER_POWER * self.SIZE_POWERS + 1
+        self.size_counts = np.zeros(bins, dtype=np.int64)
+        self.size_bytes = np.zeros(bins, dtype=np.int64)
+        self.age_counts = np.zeros(len(self.AGE_LABELS), dtype=np.int64)
+        self.age_bytes = np.zeros(len(self.AGE_LABELS), dtype=np.int64)
+        self.storage_classes = {}
+        self.prefixes = {}
+
+    def key_prefix(self, key):
+        # Folder of the key truncated to prefix_depth levels ('' for keys at the top level)
+        folders = key.split('/')[:-1][:self.prefix_depth]
+        return '/'.join(folders) + '/' if folders else ''
+
+    def add_table(self, table):
+        # Add an inventory chunk (pyarrow Table) without converting its rows to Python objects
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        prefixes = pc.struct_field(pc.extract_regex(table['Key'], f'^(?P<prefix>(?:[^/]*/){{0,{max(self.prefix_depth, 0)}}})'), [0])
+        self.add_chunk(None,
+                       table['Size'].to_numpy(),
+                       pc.cast(table['LastModified'], pa.int64()).to_numpy() / 1000,
+                       pc.fill_null(table['StorageClass'], 'STANDARD').to_numpy(zero_copy_only=False),
+                       prefixes=pc.fill_null(prefixes, '').to_numpy(zero_copy_only=False))
+
+    def add_chunk(self, keys, sizes, last_modified, storage_classes, prefixes=None):
+        # keys and storage_classes are sequences of strings, sizes are byte counts and
+        # last_modified are POSIX timestamps, all of the same length. prefixes, when given,
+        # are the precomputed key_prefix of every key and keys is not used
+        np = self.np
+        sizes = np.asarray(sizes, dtype=np.int64)
+        if not len(sizes):
+            return
+        last_modified = np.asarray(last_modified, dtype=np.float64)
+
+        self.count += len(sizes)
+        self.total_bytes += int(sizes.sum())
+        chunk_min, chunk_max = int(sizes.min()), int(sizes.max())
+        self.min_size = chunk_min if self.min_size is None else min(self.min_size, chunk_min)
+        self.max_size = chunk_max if self.max_size is None else max(self.max_size, chunk_max)
+
+        bins = self._size_bins(sizes)
+        self.size_counts += np.bincount(bins, minlength=len(self.size_counts))
+        self.size_bytes += self._weighted_bincount(bins, sizes, len(self.size_bytes))
+
+        age_days = (self.now - last_modified) / 86400
+        ages = np.digitize(age_days, self.AGE_EDGES_DAYS)
+        self.age_counts += np.bincount(ages, minlength=len(self.AGE_LABELS))
+        self.age_bytes += self._weighted_bincount(ages, sizes, len(self.AGE_LABELS))
+
+        self._rollup(self.storage_classes, np.asarray(storage_classes, dtype=object), sizes)
+        if prefixes is None:
+            prefixes = [self.key_prefix(key) for key in keys]
+        self._rollup(self.prefixes, np.asarray(prefixes, dtype=object), sizes)
+
+    def _size_bins(self, sizes):
+        # Bin 0 holds empty objects, bin i >= 1 holds sizes in [2 ** ((i - 1) / 8), 2 ** (i / 8))
+        np = self.np
+        bins = np.zeros(len(sizes), dtype=np.int64)
+        positive = sizes > 0
+        bins[positive] = np.floor(np.log2(sizes[positive]) * self.SIZE_BINS_PER_POWER).astype(np.int64) + 1
+        return np.minimum(bins, len(self.size_counts) - 1)
+
+    def _weighted_bincount(self, bins, sizes, length):
+        # Float weights are exact for totals below 2 ** 53 bytes per chunk
+        np = self.np
+        return np.rint(np.bincount(bins, weights=sizes, minlength=length)).astype(np.int64)
+
+    def _rollup(self, totals, labels, sizes):
+        np = self.np
+        unique, inverse = np.unique(labels, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(unique))
+        size_totals = self._weighted_bincount(inverse, sizes, len(unique))
+        for label, count, size_total in zip(unique.tolist(), counts.tolist(), size_totals.tolist()):
+            entry = totals.setdefault(label, [0, 0])
+            entry[0] += count
+            entry[1] += size_total
+
+    def percentiles(self):
+        # Upper bound of the fine bin holding each percentile (Within 9% of the exact value)
+        np = self.np
+        if not self.count:
+            return {}
+        cumulative = np.cumsum(self.size_counts)
+        result = {}
+        for percentile in self.PERCENTILES:
+            target = max(int(np.ceil(self.count * percentile / 100)), 1)
+            index = int(np.searchsorted(cumulative, target))
+            upper = 0 if index == 0 else int(2 ** (index / self.SIZE_BINS_PER_POWER))
+            result[f"p{percentile:g}"] = min(max(upper, self.min_size), self.max_size)
+        return result
+
+    def size_histogram(self):
+        # Collapse the fine bins into power-of-two buckets, skipping empty ones
+        per_power = self.SIZE_BINS_PER_POWER
+        histogram = []
+        if self.size_counts[0]:
+            histogram.append({'Range': '0 B', 'MinBytes': 0, 'MaxBytes': 0, 'Count': int(self.size_counts[0]), 'Bytes': 0})
+        for power in range(self.SIZE_POWERS):
+            start = 1 + power * per_power
+            count = int(self.size_counts[start:start + per_power].sum())
+            if count:
+                histogram.append({
+                    'Range': f"{format_size(2 ** power)} - {format_size(2 ** (power + 1))}",
+                    'MinBytes': 2 ** power,
+                    'MaxBytes': 2 ** (power + 1) - 1,
+                    'Count': count,
+                    'Bytes': int(self.size_bytes[start:start + per_power].sum()),
+                })
+        return histogram
+
+    def report(self, top=10):
+        return {
+            'Objects': self.count,
+            'TotalBytes': self.total_bytes,
+            'TotalSize': format_size(self.total_bytes),
+            'MinSize': self.min_size or 0,
+            'MaxSize': self.max_size or 0,
+            'MeanSize': round(self.total_bytes / self.count, 2) if self.count else 0,
+            'SizePercentiles': self.percentiles(),
+            'SizeHistogram': self.size_histogram(),
+            'Age': [{'Age': label, 'Count': int(count), 'Bytes': int(size)}
+                    for label, count, size in zip(self.AGE_LABELS, self.age_counts, self.age_bytes) if count],
+            'StorageClasses': [{'StorageClass': label, 'Count': count, 'Bytes': size}
+                               for label, (count, size) in sorted(self.storage_classes.items())],
+            'Prefixes': [{'Prefix': label, 'Count': count, 'Bytes': size}
+                         for label, (count, size) in sorted(self.prefixes.items())],
+            'LargestPrefixes': [{'Prefix': label, 'Count': count, 'Bytes': size, 'Size': format_size(size)}
+                                for label, (count, size) in sorted(self.prefixes.items(), key=lambda item: item[1][1], reverse=True)[:top]],
+        }
+
+    @staticmethod
+    def write_csv(report, output):
+        # Flatten the report into Section, Label, Count, Bytes rows
+        import csv
+        writer = csv.writer(output)
+        writer.writerow(['Section', 'Label', 'Count', 'Bytes'])
+        writer.writerow(['Summary', 'Objects', report['Objects'], report['TotalBytes']])
+        for name in ('MinSize', 'MaxSize', 'MeanSize'):
+            writer.writerow(['Summary', name, '', report[name]])
+        for name, value in report['SizePercentiles'].items():
+            writer.writerow(['SizePercentile', name, '', value])
+        for row in report['SizeHistogram']:
+            writer.writerow(['SizeHistogram', row['Range'], row['Count'], row['Bytes']])
+        for row in report['Age']:
+            writer.writerow(['Age', row['Age'], row['Count'], row['Bytes']])
+        for row in report['StorageClasses']:
+            writer.writerow(['StorageClass', row['StorageClass'], row['Count'], row['Bytes']])
+        for row in report['Prefixes']:
+            writer.writerow(['Prefix', row['Prefix'], row['Count'], row['Bytes']])
+        for row in report['LargestPrefixes']:
+            writer.writerow(['LargestPrefix', row['Prefix'], row['Count'], row['Bytes']])
+
+
+class S3InventoryReader:
+    # Streams the records of an S3 Inventory report (manifest.json plus CSV, ORC or Parquet data files)
+    # from the destination bucket or a local copy. Data files are decoded in parallel and returned as
+    # column chunks shaped like the listing, so stats and planners can skip LIST entirely
+    COLUMN_NAMES = {
+        'bucket': 'Bucket',
+        'key': 'Key',
+        'version_id': 'VersionId',
+        'is_latest': 'IsLatest',
+        'is_delete_marker': 'IsDeleteMarker',
+        'size': 'Size',
+        'last_modified_date': 'LastModifiedDate',
+        'e_tag': 'ETag',
+        'storage_class': 'StorageClass',
+    }
+
+    def __init__(self, client, manifest_location, max_workers=8):
+        self.client = client
+        self.max_workers = max_workers
+        if manifest_location.startswith('s3://'):
+            bucket_name, manifest_key = manifest_location[len('s3://'):].split('/', 1)
+            response = client.get_object(Bucket=bucket_name, Key=manifest_key)
+            self.manifest = json.loads(response['Body'].read())
+            self.local_dir = None
+        else:
+            with open(manifest_location) as manifest_file:
+                self.manifest = json.load(manifest_file)
+            self.local_dir = os.path.dirname(os.path.abspath(manifest_location))
+        self.file_format = self.manifest['fileFormat'].upper()
+        self.source_bucket = self.manifest.get('sourceBucket')
+        self.destination_bucket = self.manifest['destinationBucket'].split(':::')[-1]
+        self.files = self.manifest['files']
+        self.fields = [field.strip() for field in self.manifest.get('fileSchema', '').split(',')]
+        # CSV schemas list the field names, ORC and Parquet schemas use the snake_case column names
+        self.has_versions = 'VersionId' in self.fields or 'version_id' in self.manifest.get('fileSchema', '')
+        if self.file_format not in ('CSV', 'ORC', 'PARQUET'):
+            raise ValueError(f"Unsupported inventory format: {self.file_format}")
+
+    def iter_chunks(self, prefix='', current_only=True):
+        # Yield one pyarrow Table per data file, decoding several files at a time
+        in_flight = set()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for data_file in self.files:
+                if len(in_flight) >= self.max_workers * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                in_flight.add(executor.submit(self._read_file, data_file['key'], prefix, current_only))
+            for future in wait(in_flight)[0]:
+                yield future.result()
+
+    def iter_records(self, prefix='', current_only=True):
+        # Yield one listing-style dict per object version
+        for chunk in self.iter_chunks(prefix, current_only):
+            yield from chunk.to_pylist()
+
+    def _local_path(self, key):
+        # Data files live in the destination bucket, or next to the manifest (Or in ../data) locally
+        if self.local_dir is None:
+            return None
+        name = os.path.basename(key)
+        for candidate in (os.path.join(self.local_dir, name),
+                          os.path.join(self.local_dir, 'data', name),
+                          os.path.join(self.local_dir, os.pardir, 'data', name)):
+            if os.path.exists(candidate):
+                return candidate
+        raise FileNotFoundError(f"Inventory data file {name} not found near {self.local_dir}")
+
+    def _read_file(self, key, prefix, current_only):
+        import pyarrow.compute as pc
+        local_path = self._local_path(key)
+        if self.file_format == 'CSV':
+            table = self._read_csv(key, local_path)
+        else:
+            table = self._read_columnar(key, local_path)
+
+        table = self._normalize(table)
+        if current_only or prefix:
+            mask = pc.starts_with(table['Key'], prefix)
+            if current_only:
+                # Rows without the version columns count as current objects
+                mask = pc.and_(mask, pc.fill_null(table['IsLatest'], True))
+                mask = pc.and_(mask, pc.invert(pc.fill_null(table['IsDeleteMarker'], False)))
+            table = table.filter(mask)
+        return table
+
+    def _schema(self):
+        import pyarrow as pa
+        return pa.schema([
+            ('Key', pa.string()),
+            ('Size', pa.int64()),
+            ('LastModified', pa.timestamp('ms', tz='UTC')),
+            ('StorageClass', pa.string()),
+            ('ETag', pa.string()),
+            ('VersionId', pa.string()),
+            ('IsLatest', pa.bool_()),
+            ('IsDeleteMarker', pa.bool_()),
+        ])
+
+    def _normalize(self, table):
+        # Same columns, order and types for every format, missing columns are filled with nulls
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        columns = []
+        for field in self._schema():
+            if field.name in table.column_names:
+                column = table[field.name]
+                if column.type != field.type:
+                    column = pc.cast(column, field.type)
+            else:
+                column = pa.nulls(table.num_rows, field.type)
+            if field.name == 'Size':
+                column = pc.fill_null(column, 0)
+            columns.append(column)
+        return pa.Table.from_arrays(columns, schema=self._schema())
+
+    def _read_csv(self, key, local_path):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        from pyarrow import csv
+        from urllib.parse import unquote_plus
+        if local_path:
+            raw = open(local_path, 'rb')
+        else:
+            raw = self.client.get_object(Bucket=self.destination_bucket, Key=key)['Body']
+        names = ['LastModified' if field == 'LastModifiedDate' else field for field in self.fields]
+        schema = self._schema()
+        try:
+            # pyarrow parses the rows on its own threads with the GIL released
+            with pa.input_stream(raw, compression='gzip') as stream:
+                table = csv.read_csv(
+                    stream,
+                    read_options=csv.ReadOptions(column_names=names, use_threads=True),
+                    convert_options=csv.ConvertOptions(
+                        column_types={name: schema.field(name).type for name in names if name in schema.names},
+                        include_columns=[name for name in names if name in schema.names],
+                        null_values=[''], strings_can_be_null=True))
+        finally:
+            raw.close()
+
+        # CSV inventories URL-encode the keys, only the ones with an escape need decoding
+        keys = table['Key'].combine_chunks()
+        encoded = pc.match_substring_regex(keys, '[%+]')
+        if pc.any(encoded).as_py():
+            decoded = pa.array([unquote_plus(key) for key in pc.filter(keys, encoded).to_pylist()], pa.string())
+            keys = pc.replace_with_mask(keys, encoded, decoded)
+            table = table.set_column(table.column_names.index('Key'), 'Key', keys)
+        return table
+
+    def _read_columnar(self, key, local_path):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        if self.file_format == 'ORC':
+            from pyarrow import orc
+        else:
+            import pyarrow.parquet as pq
+
+        # Columnar files are read through ranged GETs so only the needed columns are transferred
+        source = local_path or S3ObjectReader(self.client, self.destination_bucket, key)
+        try:
+            if self.file_format == 'ORC':
+                orc_file = orc.ORCFile(source)
+                names = [name for name in orc_file.schema.names if name in self.COLUMN_NAMES]
+                table = orc_file.read(columns=names)
+            else:
+                parquet_file = pq.ParquetFile(source)
+                names = [name for name in parquet_file.schema_arrow.names if name in self.COLUMN_NAMES]
+                table = parquet_file.read(columns=names)
+        finally:
+            if not local_path:
+                source.close()
+
+        table = table.rename_columns(['LastModified' if name == 'last_modified_date' else self.COLUMN_NAMES[name]
+                                      for name in table.column_names])
+        if 'LastModified' in table.column_names:
+            column = table['LastModified']
+            if pa.types.is_timestamp(column.type) and column.type.tz is None:
+                # Timestamps without a time zone are UTC
+                column = pc.assume_timezone(column, 'UTC')
+            table = table.set_column(table.column_names.index('LastModified'), 'LastModified', column)
+        return table
+
+
+class ContentTypeCache:
+    # Persistent cache of detected MIME types keyed by (path, size, mtime), stored in SQLite.
+    # Only used from one thread, detection workers hand their results back to the caller
+    def __init__(self, path):
+        import sqlite3
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS content_types ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, mime_type TEXT NOT NULL)")
+
+    def lookup(self, path, size, mtime_ns):
+        row = self.connection.execute(
+            "SELECT mime_type FROM content_types WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (path, size, mtime_ns)).fetchone()
+        return row[0] if row else None
+
+    def store(self, rows):
+        # rows are (path, size, mtime_ns, mime_type) tuples
+        if rows:
+            with self.connection:
+                self.connection.executemany("INSERT OR REPLACE INTO content_types VALUES (?, ?, ?, ?)", rows)
+
+    def close(self):
+        self.connection.close()
+
+
+class BucketRegionCache:
+    # Persistent bucket -> region map stored as JSON, shared by the sync and async clients
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path) as cache_file:
+                self._regions = json.load(cache_file)
+        except (FileNotFoundError, ValueError):
+            self._regions = {}
+
+    def get(self, bucket_name):
+        with self._lock:
+            return self._regions.get(bucket_name)
+
+    def set(self, bucket_name, region):
+        with self._lock:
+            if self._regions.get(bucket_name) == region:
+                return
+            self._regions[bucket_name] = region
+            write_json_atomic(self.path, self._regions)
+
+    def forget(self, bucket_name):
+        with self._lock:
+            if self._regions.pop(bucket_name, None) is not None:
+                write_json_atomic(self.path, self._regions)
+
+    def watch(self, client):
+        # Drop a bucket's cached region as soon as a request made with client is answered with a
+        # redirect, so the next lookup resolves it again (e.g. after the bucket was recreated elsewhere)
+        def remember_bucket(params, context, **kwargs):
+            context['cached_region_bucket'] = params.get('Bucket')
+
+        def forget_on_redirect(request_dict, response, **kwargs):
+            if response is None:
+                return
+            http_response, parsed = response
+            code = parsed.get('Error', {}).get('Code')
+            if http_response.status_code == 301 or code in ('PermanentRedirect', 'AuthorizationHeaderMalformed'):
+                bucket_name = request_dict['context'].get('cached_region_bucket')
+                if bucket_name:
+                    self.forget(bucket_name)
+
+        # Registered first so it runs before botocore's own redirect handling retries the request
+        client.meta.events.register('before-parameter-build.s3', remember_bucket, unique_id='cached-region-bucket')
+        client.meta.events.register_first('needs-retry.s3', forget_on_redirect, unique_id='cached-region-redirect')
+
+
+class S3ClientPool:
+    # One S3 client per region, all created from the same session and CLIENT_CONFIG.
+    # Buckets are mapped to their region through the persistent cache so every request
+    # goes to the right regional endpoint on the first try instead of through a 301 redirect
+    def __init__(self, session, default_client, region_cache):
+        self.session = session
+        self.default_client = default_client
+        self.region_cache = region_cache
+        self._clients = {default_client.meta.region_name: default_client}
+        self._lock = threading.Lock()
+        # Buckets whose region could not be found, kept for this process only so a missing
+        # s3:GetBucketLocation permission costs one failed lookup per bucket and not one per request
+        self._failed_lookups = {}
+        region_cache.watch(default_client)
+
+    def client(self, region):
+        with self._lock:
+            client = self._clients.get(region)
+            if client is None:
+                # Sessions are not thread-safe, create clients under the lock
+                client = self.session.client("s3", region_name=region, endpoint_url=getenv("endpoint_url") or None, config=CLIENT_CONFIG)
+                self.region_cache.watch(client)
+                self._clients[region] = client
+            return client
+
+    def region_for(self, bucket_name):
+        # Region of a bucket from the cache, otherwise from GetBucketLocation, otherwise from the
+        # x-amz-bucket-region header of HeadBucket (Sent even on 403 and 301 responses)
+        region = self.region_cache.get(bucket_name)
+        if region is not None:
+            return region
+        with self._lock:
+            failure = self._failed_lookups.get(bucket_name)
+        if failure is not None:
+            raise failure
+        try:
+            location = self.default_client.get_bucket_location(Bucket=bucket_name)
+            # If the region is None, the bucket is in us-east-1 (Normal System behavior)
+            region = location['LocationConstraint'] or 'us-east-1'
+            if region == 'EU':
+                region = 'eu-west-1'
+        except ClientError as e:
+            region = self._region_header(e.response)
+            if region is None:
+                try:
+                    region = self._region_header(self.default_client.head_bucket(Bucket=bucket_name))
+                except ClientError as head_error:
+                    region = self._region_header(head_error.response)
+            if region is None:
+                with self._lock:
+                    self._failed_lookups[bucket_name] = e
+                raise
+        self.region_cache.set(bucket_name, region)
+        return region
+
+    def _region_header(self, response):
+        return response.get('ResponseMetadata', {}).get('HTTPHeaders', {}).get('x-amz-bucket-region')
+
+    def client_for(self, bucket_name):
+        return self.client(self.region_for(bucket_name))
+
+    def forget(self, bucket_name):
+        with self._lock:
+            self._failed_lookups.pop(bucket_name, None)
+        self.region_cache.forget(bucket_name)
+
+
+class AsyncS3Client:
+    # asyncio counterpart of S3Client built on aiobotocore. Every request goes through one semaphore,
+    # so thousands of operations can be scheduled on one event loop while at most max_concurrency are in flight.
+    # Usage: async with AsyncS3Client() as s3: data = await s3.get_object(bucket_name, key)
+    def __init__(self, max_concurrency=256, part_size=DEFAULT_BLOCK_SIZE, region_cache=None, session=None):
+        self.max_concurrency = max_concurrency
+        self.part_size = part_size
+        # Credentials and the default region come from a boto3 session (S3Client.session, or one built the same way),
+        # so empty .env values fall back to the default credential chain instead of being sent as keys
+        self.boto_session = session or boto3.Session(
+            aws_access_key_id=getenv("aws_access_key_id"),
+            aws_secret_access_key=getenv("aws_secret_access_key"),
+            aws_session_token=getenv("aws_session_token"),
+            region_name=getenv("region"))
+        self.region_cache = region_cache or BucketRegionCache(os.path.join(get_cache_dir(), 'bucket-regions.json'))
+        self.endpoint_url = getenv("endpoint_url") or None
+        self._clients = {}
+        self._default_client = None
+
+    async def __aenter__(self):
+        from aiobotocore.session import get_session
+        from contextlib import AsyncExitStack
+        self._session = get_session()
+        self._exit_stack = AsyncExitStack()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._client_lock = asyncio.Lock()
+        # Resolving the credential chain can reach the instance metadata service, keep it off the event loop
+        credentials = await asyncio.to_thread(self.boto_session.get_credentials)
+        self._credentials = credentials.get_frozen_credentials() if credentials else None
+        self._default_client = await self._client(self.boto_session.region_name)
+        self._region_pool = None
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self._exit_stack.aclose()
+        self._clients.clear()
+
+    async def _client(self, region):
+        from aiobotocore.config import AioConfig
+        async with self._client_lock:
+            client = self._clients.get(region)
+            if client is None:
+                config = AioConfig(max_pool_connections=self.max_concurrency, retries={'max_attempts': 8, 'mode': 'adaptive'},
+                                   connector_args={'keepalive_timeout': 60})
+                client = await self._exit_stack.enter_async_context(self._session.create_client(
+                    "s3",
+                    region_name=region,
+                    aws_access_key_id=self._credentials.access_key if self._credentials else None,
+                    aws_secret_access_key=self._credentials.secret_key if self._credentials else None,
+                    aws_session_token=self._credentials.token if self._credentials else None,
+                    endpoint_url=self.endpoint_url,
+                    config=config))
+                self.region_cache.watch(client)
+                self._clients[region] = client
+            return client
+
+    async def client_for(self, bucket_name):
+        # Regional client from the shared bucket -> region cache (Local stand-ins only use the default client)
+        if self.endpoint_url:
+            return self._default_client
+        region = self.region_cache.get(bucket_name)
+        if region is None:
+            # Cache misses use the same lookup as S3Client, run off the event loop
+            async with self._client_lock:
+                if self._region_pool is None:
+                    default_client = await asyncio.to_thread(
+                        self.boto_session.client, "s3", region_name=self.boto_session.region_name, config=CLIENT_CONFIG)
+                    self._region_pool = S3ClientPool(self.boto_session, default_client, self.region_cache)
+            try:
+                async with self._semaphore:
+                    region = await asyncio.to_thread(self._region_pool.region_for, bucket_name)
+            except ClientError:
+                return self._default_client
+        return await self._client(region)
+
+    async def _call(self, bucket_name, operation, **kwargs):
+        client = await self.client_for(bucket_name)
+        async with self._semaphore:
+            response = await getattr(client, operation)(Bucket=bucket_name, **kwargs)
+        response.pop('ResponseMetadata', None)
+        return response
+
+    async def _gather_parts(self, coroutines):
+        # Run the part transfers of one file, cancelling the remaining ones as soon as one fails
+        tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def list_objects(self, bucket_name, prefix=''):
+        # Async iterator over the objects under a prefix, one listing page at a time
+        client = await self.client_for(bucket_name)
+        paginator = client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(Bucket=bucket_name, Prefix=prefix).__aiter__()
+        while True:
+            async with self._semaphore:
+                try:
+                    page = await pages.__anext__()
+                except StopAsyncIteration:
+                    return
+            for item in page.get('Contents', []):
+                yield item
+
+    async def get_object(self, bucket_name, key, byte_range=None):
+        # Object body as bytes (byte_range is an inclusive (start, end) tuple)
+        client = await self.client_for(bucket_name)
+        kwargs = {'Range': f"bytes={byte_range[0]}-{byte_range[1]}"} if byte_range else {}
+        async with self._semaphore:
+            response = await client.get_object(Bucket=bucket_name, Key=key, **kwargs)
+            async with response['Body'] as stream:
+                return await stream.read()
+
+    async def put_object(self, bucket_name, key, body, **kwargs):
+        return await self._call(bucket_name, 'put_object', Key=key, Body=body, **kwargs)
+
+    async def head_object(self, bucket_name, key):
+        return await self._call(bucket_name, 'head_object', Key=key)
+
+    async def copy_object(self, bucket_name, key, new_key, source_bucket=None):
+        source = {'Bucket': source_bucket or bucket_name, 'Key': key}
+        return await self._call(bucket_name, 'copy_object', CopySource=source, Key=new_key)
+
+    async def delete_objects(self, bucket_name, keys):
+        # Delete any number of keys with concurrent batches of 1000 and return the per-key errors
+        keys = list(keys)
+        batches = [keys[i:i + 1000] for i in range(0, len(keys), 1000)]
+        responses = await asyncio.gather(*[
+            self._call(bucket_name, 'delete_objects', Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True})
+            for batch in batches])
+        return [error for response in responses for error in response.get('Errors', [])]
+
+    async def upload_file(self, bucket_name, key, filename, **kwargs):
+        # Upload a file, using a multipart upload with concurrent parts above part_size
+        size = os.path.getsize(filename)
+        if size <= self.part_size:
+            with open(filename, 'rb') as file:
+                body = await asyncio.to_thread(file.read)
+            return await self.put_object(bucket_name, key, body, **kwargs)
+
+        mpu = await self._call(bucket_name, 'create_multipart_upload', Key=key, **kwargs)
+        upload_id = mpu['UploadId']
+        read_lock = threading.Lock()
+
+        def read_part(file, offset):
+            with read_lock:
+                file.seek(offset)
+                return file.read(self.part_size)
+
+        async def upload_part(file, part_number):
+            # The slot is taken before the part is read, so at most max_concurrency parts are held in memory
+            client = await self.client_for(bucket_name)
+            async with self._semaphore:
+                data = await asyncio.to_thread(read_part, file, (part_number - 1) * self.part_size)
+                part = await client.upload_part(Bucket=bucket_name, Key=key, UploadId=upload_id, PartNumber=part_number, Body=data)
+            return {'PartNumber': part_number, 'ETag': part['ETag']}
+
+        try:
+            with open(filename, 'rb') as file:
+                part_count = (size + self.part_size - 1) // self.part_size
+                parts = await self._gather_parts(upload_part(file, number) for number in range(1, part_count + 1))
+            return await self._call(bucket_name, 'complete_multipart_upload', Key=key, UploadId=upload_id,
+                                    MultipartUpload={'Parts': parts})
+        except BaseException:
+            await self._call(bucket_name, 'abort_multipart_upload', Key=key, UploadId=upload_id)
+            raise
+
+    async def download_file(self, bucket_name, key, filename):
+        # Download an object with concurrent ranged GETs into a temporary file that is renamed into place
+        metadata = await self.head_object(bucket_name, key)
+        size = metadata['ContentLength']
+        etag = metadata['ETag']
+        temp_path = f"{filename}.{os.getpid()}.s3tmp"
+        write_lock = threading.Lock()
+
+        def write_part(file, offset, data):
+            with write_lock:
+                file.seek(offset)
+                file.write(data)
+
+        async def download_part(file, offset):
+            end = min(offset + self.part_size, size) - 1
+            client = await self.client_for(bucket_name)
+            async with self._semaphore:
+                response = await client.get_object(Bucket=bucket_name, Key=key, Range=f"bytes={offset}-{end}", IfMatch=etag)
+                async with response['Body'] as stream:
+                    data = await stream.read()
+            await asyncio.to_thread(write_part, file, offset, data)
+
+        try:
+            with open(temp_path, 'wb') as file:
+                file.truncate(size)
+                await self._gather_parts(download_part(file, offset) for offset in range(0, size, self.part_size))
+            os.replace(temp_path, filename)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return filename
+
+
+class SigV4Presigner:
+    # Local SigV4 query-string signing for S3 URLs. The signing key only depends on the day, region and
+    # service, so it is derived once per (date, region, service) and each URL then costs one SHA-256 and one HMAC
+    def __init__(self, credentials, endpoint_url=None):
+        self.access_key = credentials.access_key
+        self.secret_key = credentials.secret_key
+        self.token = credentials.token
+        self.endpoint_url = endpoint_url
+        self._signing_keys = {}
+
+    def signing_key(self, datestamp, region, service='s3'):
+        cache_key = (datestamp, region, service)
+        key = self._signing_keys.get(cache_key)
+        if key is None:
+            key = ('AWS4' + self.secret_key).encode('utf-8')
+            for part in (datestamp, region, service, 'aws4_request'):
+                key = hmac.new(key, part.encode('utf-8'), sha256).digest()
+            self._signing_keys[cache_key] = key
+        return key
+
+    def base_url(self, bucket_name, region):
+        # Virtual-hosted style, or path style for custom endpoints and bucket names with dots (TLS wildcard)
+        if self.endpoint_url:
+            endpoint = urlsplit(self.endpoint_url)
+            return endpoint.scheme, endpoint.netloc, f"/{bucket_name}/"
+        if '.' in bucket_name:
+            return 'https', f"s3.{region}.amazonaws.com", f"/{bucket_name}/"
+        return 'https', f"{bucket_name}.s3.{region}.amazonaws.com", '/'
+
+    def presign(self, bucket_name, region, keys, method='GET', expires=3600, now=None):
+        # Yield (key, url) pairs. One timestamp and one signing key are shared by the whole batch
+        now = now or datetime.now(pytz.utc)
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        datestamp = amz_date[:8]
+        scope = f"{datestamp}/{region}/s3/aws4_request"
+        signing_key = self.signing_key(datestamp, region)
+        scheme, host, path_prefix = self.base_url(bucket_name, region)
+
+        params = {
+            'X-Amz-Algorithm': 'AWS4-HMAC-SHA256',
+            'X-Amz-Credential': f"{self.access_key}/{scope}",
+            'X-Amz-Date': amz_date,
+            'X-Amz-Expires': str(expires),
+            'X-Amz-SignedHeaders': 'host',
+        }
+        if self.token:
+            params['X-Amz-Security-Token'] = self.token
+        query = '&'.join(f"{quote(name, safe='-_.~')}={quote(value, safe='-_.~')}" for name, value in sorted(params.items()))
+        request_prefix = f"{method}\n"
+        request_suffix = f"\n{query}\nhost:{host}\n\nhost\nUNSIGNED-PAYLOAD"
+        string_prefix = f"AWS4-HMAC-SHA256\n{amz_date}\n{scope}\n"
+
+        for key in keys:
+            path = path_prefix + quote(key, safe='/~')
+            canonical_request = request_prefix + path + request_suffix
+            string_to_sign = string_prefix + sha256(canonical_request.encode('utf-8')).hexdigest()
+            signature = hmac.new(signing_key, string_to_sign.encode('utf-8'), sha256).hexdigest()
+            yield key, f"{scheme}://{host}{path}?{query}&X-Amz-Signature={signature}"
+
 
 # Run the script
 if __name__ == "__main__":